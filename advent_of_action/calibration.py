@@ -0,0 +1,49 @@
+"""Calibration, which scores how fast a machine is, so that times measured on different machines can be compared.
+
+A machine's score is how many times faster than the reference machine it runs a fixed CPU-bound workload and a fixed
+memory-bound workload (the geometric mean of the two), so a machine that is twice as fast at both scores 2.0 and a
+time multiplied by the score of the machine it was measured on is roughly what it would have been on the reference
+machine. The workloads are run by the interpreter we were started with, so its version affects the score too.
+"""
+
+import math
+import time
+from collections.abc import Callable
+from typing import Final
+
+# How long each workload took, at best, on the reference machine, which therefore scores 1.0.
+REFERENCE_SECONDS: Final = {"cpu": 0.1, "memory": 0.1}
+
+# How many times to run each workload, of which only the fastest counts, as the others may have been interrupted.
+ROUNDS: Final = 3
+
+
+def cpu_workload() -> int:
+    """Do some integer arithmetic, which needs no more memory than fits in the CPU's caches."""
+    total = 0
+    for i in range(1_000_000):
+        total = (total * 31 + i) % 1_000_003
+    return total
+
+
+def memory_workload() -> int:
+    """Fill a buffer that is too big for the CPU's caches, read every cache line of it and then copy it."""
+    buffer = bytes(range(256)) * (256 * 1024)
+    return len(buffer[::64]) + len(bytearray(buffer))
+
+
+def fastest(workload: Callable[[], int]) -> float:
+    """Get the shortest time, in seconds, that a workload took in ROUNDS runs."""
+    times: list[float] = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        workload()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def machine_score() -> float:
+    """Score this machine, relative to the reference machine, by running the CPU-bound and memory-bound workloads."""
+    cpu = REFERENCE_SECONDS["cpu"] / fastest(cpu_workload)
+    memory = REFERENCE_SECONDS["memory"] / fastest(memory_workload)
+    return math.sqrt(cpu * memory)
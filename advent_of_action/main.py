@@ -1,16 +1,86 @@
 """Run every solution."""
 
+import argparse
+import asyncio
+import hashlib
+import itertools
+import math
+import multiprocessing
 import os
-from collections.abc import Generator, Mapping, MutableMapping
-from contextlib import contextmanager
+import shutil
+import statistics
+import time
+from collections import ChainMap
+from collections.abc import AsyncGenerator, Collection, Generator, Iterable, Mapping, MutableMapping, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import (
+    AbstractAsyncContextManager,
+    AbstractContextManager,
+    ExitStack,
+    asynccontextmanager,
+    closing,
+    contextmanager,
+    nullcontext,
+)
+from datetime import UTC, datetime
+from functools import cache
 from pathlib import Path
+from queue import SimpleQueue
 from subprocess import CalledProcessError, TimeoutExpired, run
+from tempfile import TemporaryDirectory
+from threading import Lock, get_ident
 from typing import Final
 
 import pygount
 
 from advent_of_action import runners
-from advent_of_action.runners import Commands, Part, execute_command
+from advent_of_action.calibration import machine_score
+from advent_of_action.reports import (
+    Regression,
+    find_regressions,
+    readme_results,
+    report_counters,
+    report_machines,
+    report_phases,
+    report_regressions,
+    write_results,
+)
+from advent_of_action.runners import (
+    Commands,
+    Measurement,
+    OutOfMemory,
+    Part,
+    Sandbox,
+    cache_dir,
+    execute_command_async,
+    perf_available,
+    perf_command,
+    read_perf_stat,
+)
+from advent_of_action.shards import SHARDS, merge_shards, plan_report, shard
+from advent_of_action.store import (
+    STORE,
+    Day,
+    Digest,
+    FileCount,
+    Language,
+    Person,
+    Record,
+    Run,
+    Sample,
+    Seconds,
+    Stat,
+    Stats,
+    append_to_store,
+    linecount,
+    normalised,
+    ranking_metric,
+    read_line_counts,
+    read_store,
+    solution_line_counts,
+    write_line_counts,
+)
+from advent_of_action.warm import WarmRuntime
 
 # Languages and their commands
 RUNTIMES: Final = {
@@ -24,229 +94,918 @@ RUNTIMES: Final = {
     "rust": runners.RUST,
 }
 
-type Day = str
-type Language = str
-type Person = str
-type Seconds = str
-type MiBytes = str
-type Notes = str
-type Run = tuple[Day, Language, Person]
-type Stat = tuple[Seconds, MiBytes, Notes]
-type linecount = int
-type Stats = tuple[Stat, Stat, linecount]
+type Answers = tuple[str, str]
+# A solution to measure, with its answers, its input and any scaled inputs.
+type Job = tuple[Run, Path, Answers, Path, tuple[Path, ...]]
+# Held while timing, so that only one part is timed at once.
+type TimingLock = AbstractContextManager[object, bool | None] | AbstractAsyncContextManager[object, bool | None]
+
+# Whether inputs should be in the page cache, or not, when parts are timed.
+INPUT_CACHES: Final = ("warm", "cold")
+
+# How much of an input to read at once, when warming the page cache with it.
+INPUT_CHUNK: Final = 1024 * 1024
+
+# Filesystems whose files are only in memory, so can't be taken out of the page cache.
+MEMORY_FILESYSTEMS: Final = frozenset({"tmpfs", "ramfs"})
+
+# Files and directories made by running a solution, which shouldn't cause it to be re-run.
+GENERATED: Final = frozenset(
+    {"input.txt", "solution", "target", "dist-newstyle", "_build", "__pycache__", ".venv", "node_modules"}
+)
+
+# Directories of other people's code, which don't count towards a solution's lines.
+VENDORED: Final = frozenset({".git", "vendor", "third_party"})
+
+# The file extension of each language's source code.
+EXTENSIONS: Final = {
+    "python": "py",
+    "fsharp": "fsx",
+    "go": "go",
+    "haskell": "hs",
+    "ocaml": "ml",
+    "racket": "rkt",
+    "rust": "rs",
+    "jupyter": "ipynb",
+}
 
 
-def measure_execution_time(answers: tuple[str, str], comm: Commands) -> tuple[Stat, Stat]:
-    """Measure the execution time of a solution."""
+def precise_enough(samples: Sequence[float], precision: float) -> bool:
+    """Whether the 95% confidence interval of the mean is within precision, relative to the median, of it."""
+    if len(samples) < 2:
+        return False
+    half_width = 1.96 * statistics.stdev(samples) / math.sqrt(len(samples))
+    return half_width <= precision * statistics.median(samples)
 
-    def inner(part: Part, answer: str | None, command: list[str | Path]) -> Stat:
-        """Use the runner to measure the execution time of one part."""
-        try:
-            if answer is not None:
-                kibytes, seconds, output = execute_command(command, part=part)
-                if output != answer:
-                    print(f"Incorrect answer for part {part}: {output}")
-                    return "", "", "Different answer"
-                else:
-                    return f"{seconds:.2f}", f"{kibytes / 1024.0:.1f}", ""
-            else:
-                # Ignore empty lists.
-                if command:
-                    execute_command(command, timeout=60.0)
-                return "", "", "Done"
-
-        except CalledProcessError as e:
-            # Print all but the last line, which will be the timings.
-            print("".join(e.stderr.splitlines()[:-1]))
-            return "", "", f"Error ({e.returncode})"
-        except TimeoutExpired as e:
-            print(f"Command timed out after {e.timeout:.0f} seconds")
-            return "", "", "Timeout"
-
-    return (
-        inner(Part.SETUP, None, comm.setup),
-        inner(Part.ONE, answers[0], comm.run),
-        inner(Part.TWO, answers[1], comm.run),
-        inner(Part.TEARDOWN, None, comm.teardown),
-    )[1:3]
-
-
-def from_table(table: str) -> dict[Run, Stats]:
-    """Extract results from the Markdown ##Stats section."""
-    results: dict[Run, Stats] = {}
-    part_one = None
-    for line in table.splitlines()[6:]:
-        if not line:
-            break
-        day, lang, person, lines, part, seconds, kb, notes = line[1:-1].split(" | ")
-        if part == Part.ONE:
-            part_one = (seconds.strip(), kb.strip(), notes.strip())
-        elif part == Part.TWO:
-            assert part_one is not None
-            part_two = (seconds.strip(), kb.strip(), notes.strip())
-            results[(day.strip(), lang.strip(), person.strip())] = (
-                part_one,
-                part_two,
-                int(lines.strip()),
-            )
-        else:
-            raise ValueError(f"Unknown part {part}")
 
-    return results
+def measurement_settings(language: Language) -> dict[str, str]:
+    """Get the settings that change what a language's solutions' times include, such as starting the runtime."""
+    return {
+        "warm_runtime": str(bool(RUNTIMES[language].warm) and os.getenv("WARM_RUNTIMES", "false").lower() == "true"),
+        "input_cache": input_cache(),
+        "cgroup_sandbox": os.getenv("CGROUP_SANDBOX", "false").lower(),
+        "cpu_limit": os.getenv("CPU_LIMIT", ""),
+    }
 
 
-def to_table(results: Mapping[Run, Stats]) -> str:
-    """Convert results to a Markdown table."""
-    table = "\n\n## Stats\n\n"
-    table += "| day | language | who | lines | part | time (s) | mem (MiB) | notes |\n"
-    table += "| --- | --- | --- | ---: | --- | ---: | ---: | --- |\n"
-    for the_run, stats in sorted(results.items()):
-        day, language, person = the_run
-        for (seconds, kilobytes, notes), part in zip(stats[:2], (Part.ONE, Part.TWO), strict=False):
-            table += f"| {day} | {language} | {person} | {stats[2]} | {part} | {seconds} | {kilobytes} | {notes} |\n"
-    return table
-
-
-def write_results(the_results: Mapping[Run, Stats]) -> None:
-    """Write results to the README."""
-    readme = Path("README.md")
-    old_content = readme.read_text()
-    section_begins = old_content.find("\n\n## Stats")
-    if section_begins > -1:
-        section_ends = old_content.find("\n##", section_begins + 10)
-        section = old_content[section_begins:section_ends] if section_ends else old_content[section_begins:]
-        old_dict = from_table(section)
-        the_results = {**old_dict, **the_results}
-        if section_ends > -1:
-            new_content = old_content[:section_begins] + to_table(the_results) + old_content[section_ends:]
-        else:
-            new_content = old_content[:section_begins] + to_table(the_results)
+def input_cache() -> str:
+    """Get whether inputs should be warm (in the page cache) or cold when parts are timed, as INPUT_CACHE says."""
+    cache = os.getenv("INPUT_CACHE", "warm")
+    if cache not in INPUT_CACHES:
+        raise ValueError(f"INPUT_CACHE should be one of {', '.join(INPUT_CACHES)}, not {cache}.")
+    return cache
+
+
+def summarise(measurements: Sequence[Measurement], metric: str) -> Stat:
+    """Summarise the timings of one part, which will only have a spread if it was timed more than once."""
+    ranked = [getattr(x, metric) for x in measurements]
+    cpu_seconds = statistics.median(x.cpu_seconds for x in measurements)
+    wall_seconds = statistics.median(x.wall_seconds for x in measurements)
+    samples = tuple(Sample.of(x) for x in measurements)
+    mebibytes = f"{max(x.kibytes for x in measurements) / 1024.0:.1f}"
+    notes = "Throttled" if any(x.throttled for x in measurements) else ""
+    stat = Stat(
+        f"{ranked[0]:.2f}",
+        mebibytes,
+        notes,
+        cpu_seconds=f"{cpu_seconds:.2f}",
+        wall_seconds=f"{wall_seconds:.2f}",
+        parallelism=f"{cpu_seconds / wall_seconds:.2f}" if wall_seconds else "",
+        samples=samples,
+    )
+    if len(ranked) == 1:
+        return stat
+    return stat._replace(
+        seconds=f"{statistics.median(ranked):.2f}",
+        min_seconds=f"{min(ranked):.2f}",
+        stdev_seconds=f"{statistics.stdev(ranked):.2f}",
+        runs=str(len(ranked)),
+    )
+
+
+def sandbox() -> Sandbox | None:
+    """Get the cgroup, and limits, to run timed parts in, if CGROUP_SANDBOX is set."""
+    if os.getenv("CGROUP_SANDBOX", "false").lower() != "true":
+        return None
+    memory_mebibytes = os.getenv("MEMORY_LIMIT_MIB", "")
+    cpus = os.getenv("CPU_LIMIT", "")
+    return Sandbox(
+        Path(os.getenv("CGROUP_ROOT", "/sys/fs/cgroup/advent_of_action")),
+        int(memory_mebibytes) if memory_mebibytes else None,
+        float(cpus) if cpus else None,
+    )
+
+
+@asynccontextmanager
+async def held(lock: TimingLock | None) -> AsyncGenerator[None, None]:
+    """Hold a lock, if given, which may be a threading lock or, if its holders share an event loop, an asyncio one."""
+    if lock is None:
+        yield
+    elif isinstance(lock, AbstractAsyncContextManager):
+        async with lock:
+            yield
     else:
-        new_content = old_content + to_table(the_results)
-    readme.write_text(new_content)
+        with lock:
+            yield
 
 
 @contextmanager
-def chdir(new_path: Path) -> Generator[None, None, None]:
-    """Context manager for changing the current working directory."""
-    saved_path = Path.cwd()
-    os.chdir(new_path)
+def timing_phase(phases: MutableMapping[str, float] | None, phase: str) -> Generator[None, None, None]:
+    """Add the wall-clock time spent in a phase, such as setup, to phases, if given."""
+    start = time.perf_counter()
     try:
         yield
     finally:
-        os.chdir(saved_path)
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - start
+
+
+async def measure_part_async(
+    part: Part,
+    answer: str | None,
+    command: list[str | Path],
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+    runtime: WarmRuntime | None = None,
+) -> Stat:
+    """Use the runner, or the warm runtime if given, to measure the execution time of one part."""
+    try:
+        if answer is not None:
+            warmup_runs = int(os.getenv("WARMUP_RUNS", "0"))
+            repetitions = max(1, int(os.getenv("REPETITIONS", "1")))
+            max_repetitions = max(repetitions, int(os.getenv("MAX_REPETITIONS", str(repetitions))))
+            precision = float(os.getenv("TARGET_PRECISION", "0.05"))
+            metric = ranking_metric()
+            cache = input_cache()
+
+            measurements: list[Measurement] = []
+            the_sandbox = sandbox()
+            cached = ""
+            async with held(timing_lock):
+                for i in itertools.count():
+                    cached = prepare_input(directory, cache)
+                    measurement = await (
+                        execute_command_async(command, part=part, cwd=directory, sandbox=the_sandbox, answer=answer)
+                        if runtime is None
+                        else asyncio.to_thread(runtime.run, [str(part)])
+                    )
+                    if measurement.stdout != answer:
+                        print(f"Incorrect answer for part {part}: {measurement.stdout}")
+                        return Stat("", "", "Different answer", samples=(Sample.of(measurement),))
+                    if i < warmup_runs:
+                        continue
+                    measurements.append(measurement)
+                    samples = [getattr(x, metric) for x in measurements]
+                    if len(samples) >= max_repetitions or (
+                        len(samples) >= repetitions and precise_enough(samples, precision)
+                    ):
+                        break
+            return summarise(measurements, metric)._replace(input_cache=cached)
+        else:
+            # Ignore empty lists.
+            if command:
+                await execute_command_async(command, timeout=60.0, cwd=directory)
+            return Stat("", "", "Done")
+
+    except OutOfMemory as e:
+        print(e.stderr, end="")
+        print("Command ran out of memory")
+        return Stat("", "", "OOM")
+    except CalledProcessError as e:
+        print(e.stderr, end="")
+        print(f"Command exited with non-zero status {e.returncode}")
+        return Stat("", "", f"Error ({e.returncode})")
+    except TimeoutExpired as e:
+        print(f"Command timed out after {e.timeout:.0f} seconds")
+        return Stat("", "", "Timeout")
+
+
+def measure_part(
+    part: Part,
+    answer: str | None,
+    command: list[str | Path],
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+    runtime: WarmRuntime | None = None,
+) -> Stat:
+    """Measure one part, as measure_part_async does, in an event loop of its own."""
+    return asyncio.run(measure_part_async(part, answer, command, directory, timing_lock, runtime))
+
+
+def build(comm: Commands, directory: Path = Path(".")) -> Stat:
+    """Run the setup commands, such as compilation, that a solution needs before it can be timed."""
+    return measure_part(Part.SETUP, None, comm.setup, directory)
+
+
+async def measure_startup_async(
+    comm: Commands,
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+) -> Seconds:
+    """Time how long the language's runtime takes to start up and do nothing, if it has a runtime."""
+    if not comm.startup:
+        return ""
+    try:
+        async with held(timing_lock):
+            measurement = await execute_command_async(comm.startup, timeout=60.0, cwd=directory)
+    except (CalledProcessError, TimeoutExpired):
+        return ""
+    return f"{getattr(measurement, ranking_metric()):.2f}"
+
+
+def measure_startup(
+    comm: Commands,
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+) -> Seconds:
+    """Time the language's startup, as measure_startup_async does, in an event loop of its own."""
+    return asyncio.run(measure_startup_async(comm, directory, timing_lock))
+
+
+def growth_exponent(sizes: Sequence[float], values: Sequence[float]) -> str:
+    """Fit values to a power of the sizes, by least squares on a log-log scale, and get the power, if we can."""
+    points = [(math.log(size), math.log(value)) for size, value in zip(sizes, values, strict=True) if value > 0]
+    if len({x for x, _ in points}) < 2:
+        return ""
+    return f"{statistics.linear_regression(*zip(*points, strict=True)).slope:.2f}"
+
+
+async def measure_growth(
+    part: Part,
+    command: list[str | Path],
+    directory: Path,
+    scaled_inputs: Sequence[Path],
+    timing_lock: TimingLock | None = None,
+) -> dict[str, str]:
+    """Run a part once on each scaled input, smallest first, until it fails, and fit how its time and memory grow."""
+    sizes: list[int] = []
+    measurements: list[Measurement] = []
+    the_sandbox = sandbox()
+    async with held(timing_lock):
+        for scaled in sorted(scaled_inputs, key=lambda x: x.stat().st_size):
+            link_input(scaled, directory)
+            try:
+                measurements.append(await execute_command_async(command, part=part, cwd=directory, sandbox=the_sandbox))
+            except (CalledProcessError, TimeoutExpired):
+                break
+            sizes.append(scaled.stat().st_size)
+    times = [getattr(x, ranking_metric()) for x in measurements]
+    return {
+        "time_growth": growth_exponent(sizes, times),
+        "memory_growth": growth_exponent(sizes, [x.kibytes for x in measurements]),
+    }
+
+
+async def measure_counters(
+    part: Part,
+    command: list[str | Path],
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+) -> dict[str, float]:
+    """Run a part once more, untimed, under perf stat, if we may and get its instructions per cycle and other counts."""
+    if not perf_available():
+        return {}
+    with TemporaryDirectory() as tmp:
+        output = Path(tmp) / "perf.csv"
+        try:
+            async with held(timing_lock):
+                await execute_command_async(perf_command(command, output), part=part, cwd=directory)
+        except (CalledProcessError, TimeoutExpired):
+            return {}
+        counters = read_perf_stat(output.read_text())
+    if counters.get("cycles") and "instructions" in counters:
+        counters["ipc"] = counters["instructions"] / counters["cycles"]
+    return counters
+
+
+async def measure_execution_time_async(
+    answers: Answers,
+    comm: Commands,
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+    scaled_inputs: Sequence[Path] = (),
+    phases: MutableMapping[str, float] | None = None,
+) -> tuple[Stat, Stat]:
+    """Measure the execution time, and the startup time, of a built solution, warm if we can, and tear it down."""
+    warm = comm.warm and os.getenv("WARM_RUNTIMES", "false").lower() == "true"
+    with closing(WarmRuntime(comm.warm, directory)) if warm else nullcontext(None) as runtime:
+        with timing_phase(phases, "one"):
+            one = await measure_part_async(Part.ONE, answers[0], comm.run, directory, timing_lock, runtime)
+        with timing_phase(phases, "two"):
+            two = await measure_part_async(Part.TWO, answers[1], comm.run, directory, timing_lock, runtime)
+    if os.getenv("PERF_COUNTERS", "false").lower() == "true":
+        # Before the scaled inputs, which replace the solution's input.
+        with timing_phase(phases, "counters"):
+            one, two = [
+                stat._replace(counters=await measure_counters(part, comm.run, directory, timing_lock))
+                if stat.seconds
+                else stat
+                for stat, part in ((one, Part.ONE), (two, Part.TWO))
+            ]
+    if scaled_inputs:
+        with timing_phase(phases, "scaling"):
+            one, two = [
+                stat._replace(**await measure_growth(part, comm.run, directory, scaled_inputs, timing_lock))
+                if stat.seconds
+                else stat
+                for stat, part in ((one, Part.ONE), (two, Part.TWO))
+            ]
+    if one.seconds or two.seconds:
+        with timing_phase(phases, "startup"):
+            startup = await measure_startup_async(comm, directory, timing_lock)
+        one, two = (stat._replace(startup_seconds=startup) if stat.seconds else stat for stat in (one, two))
+    with timing_phase(phases, "teardown"):
+        await measure_part_async(Part.TEARDOWN, None, comm.teardown, directory)
+    return one, two
+
+
+def measure_execution_time(
+    answers: Answers,
+    comm: Commands,
+    directory: Path = Path("."),
+    timing_lock: TimingLock | None = None,
+    scaled_inputs: Sequence[Path] = (),
+    phases: MutableMapping[str, float] | None = None,
+) -> tuple[Stat, Stat]:
+    """Measure a built solution, as measure_execution_time_async does, in an event loop in this (pinned) thread."""
+    return asyncio.run(measure_execution_time_async(answers, comm, directory, timing_lock, scaled_inputs, phases))
+
+
+def allowed_cpus() -> set[int]:
+    """Get the CPUs that we are allowed to run on, which is all of them if the OS can't say."""
+    if hasattr(os, "sched_getaffinity"):
+        return os.sched_getaffinity(0)
+    return set(range(os.cpu_count() or 1))
+
+
+def available_cpus(physical_only: bool) -> list[int]:
+    """List the CPUs we may pin to, optionally keeping only one logical CPU per physical core."""
+    cores: dict[tuple[str, str], int] = {}
+    for cpu in sorted(allowed_cpus()):
+        if not physical_only:
+            cores[(str(cpu), "")] = cpu
+            continue
+        topology = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology")
+        try:
+            core = ((topology / "physical_package_id").read_text(), (topology / "core_id").read_text())
+        except OSError:
+            core = (str(cpu), "")
+        cores.setdefault(core, cpu)
+    return list(cores.values())
+
+
+def restrict_thread(cpus: set[int]) -> None:
+    """Restrict the calling thread, and so any process it spawns, to some CPUs, if the OS lets us."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def pin_thread(cpus: SimpleQueue[set[int]]) -> None:
+    """Pin the calling worker thread, and so any process it spawns, to CPUs of its own."""
+    restrict_thread(cpus.get_nowait())
+
+
+def share_cpus(cpus: Sequence[int], jobs: int) -> tuple[list[set[int]], set[int]]:
+    """Share CPUs equally between up to jobs timing workers, keeping at least one spare, unless there is only one."""
+    timing_cpus = cpus[:-1] if len(cpus) > 1 else cpus
+    workers = max(1, min(jobs, len(timing_cpus)))
+    share = len(timing_cpus) // workers
+    return [set(timing_cpus[x * share : (x + 1) * share]) for x in range(workers)], set(cpus[workers * share :])
+
+
+def store_artifact(artifact: Path, stored: Path) -> None:
+    """Add a built program to the artifact store, all at once, so that nobody can copy part of it."""
+    stored.parent.mkdir(parents=True, exist_ok=True)
+    partial = stored.with_name(f"{stored.name}.{os.getpid()}.{get_ident()}")
+    shutil.copy2(artifact, partial)
+    partial.replace(stored)
+
+
+def build_solution(
+    solution_dir: Path, language: Language, input_file: Path, phases: MutableMapping[str, float] | None = None
+) -> Stat:
+    """Give one solution its input and build it, unless its program is in the artifact store, in CACHE_DIR."""
+    with timing_phase(phases, "setup"):
+        return build_or_restore(solution_dir, language, input_file)
+
+
+def build_or_restore(solution_dir: Path, language: Language, input_file: Path) -> Stat:
+    """Give one solution its input and either build it or copy its program from the artifact store."""
+    link_input(input_file, solution_dir)
+    comm = RUNTIMES[language]
+    if not comm.artifact:
+        return build(comm, solution_dir)
+
+    artifact = solution_dir / comm.artifact
+    stored = cache_dir() / "artifacts" / f"{language}-{source_digest(solution_dir, language)}"
+    if stored.exists():
+        print(f"Using the stored build of {solution_dir}")
+        artifact.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(stored, artifact)
+        return Stat("", "", "Done")
+    stat = build(comm, solution_dir)
+    if stat.notes == "Done" and artifact.exists():
+        store_artifact(artifact, stored)
+    return stat
+
+
+def measure_solution(
+    solution_dir: Path,
+    answers: Answers,
+    language: Language,
+    timing_lock: TimingLock | None,
+    scaled_inputs: tuple[Path, ...] = (),
+    phases: MutableMapping[str, float] | None = None,
+) -> tuple[Stat, Stat]:
+    """Measure and tear down one built solution."""
+    return measure_execution_time(answers, RUNTIMES[language], solution_dir, timing_lock, scaled_inputs, phases)
+
+
+def run_solutions(
+    jobs: Sequence[Job],
+    line_counts: MutableMapping[str, FileCount] | None = None,
+    phases: MutableMapping[Run, dict[str, float]] | None = None,
+) -> dict[Run, Stats]:
+    """Build solutions in parallel, time each one as soon as it has been built and count their lines meanwhile."""
+    cpus = available_cpus(os.getenv("PHYSICAL_CORES_ONLY", "false").lower() == "true")
+    worker_cpus, spare_cpus = share_cpus(cpus, int(os.getenv("JOBS", "1")))
+    workers = len(worker_cpus)
+    cpu_queue: SimpleQueue[set[int]] = SimpleQueue()
+    for each in worker_cpus:
+        cpu_queue.put(each)
+    build_workers = max(1, int(os.getenv("BUILD_JOBS", "1")))
+    timing_lock = Lock() if os.getenv("EXCLUSIVE_TIMING", "false").lower() == "true" else None
+    counts: MutableMapping[str, FileCount] = {} if line_counts is None else line_counts
+    timings: MutableMapping[Run, dict[str, float]] = {} if phases is None else phases
+    for the_run, *_ in jobs:
+        timings.setdefault(the_run, {})
+
+    measurements: dict[Run, Future[tuple[Stat, Stat]]] = {}
+    with (
+        # Spawn, rather than fork, the counters since the other pools' threads may be running by then.
+        ProcessPoolExecutor(
+            max_workers=build_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=restrict_thread,
+            initargs=(spare_cpus or allowed_cpus(),),
+        ) as counters,
+        ThreadPoolExecutor(max_workers=workers, initializer=pin_thread, initargs=(cpu_queue,)) as timers,
+        ThreadPoolExecutor(
+            max_workers=build_workers, initializer=restrict_thread, initargs=(spare_cpus or allowed_cpus(),)
+        ) as builders,
+    ):
+        counted = {
+            the_run: counters.submit(
+                count_solution_lines, the_run[1], solution_dir, solution_line_counts(counts, solution_dir)
+            )
+            for the_run, solution_dir, *_ in jobs
+        }
+        builds = {
+            builders.submit(build_solution, solution_dir, the_run[1], input_file, timings[the_run]): (
+                the_run,
+                solution_dir,
+                answers,
+                scaled,
+            )
+            for the_run, solution_dir, answers, input_file, scaled in jobs
+        }
+        done: Iterable[Future[Stat]] = as_completed(builds)
+        if not spare_cpus:
+            # Building and counting would share the only CPU with the timed parts, so finish them first.
+            wait(counted.values())
+            done = list(done)
+        for built in done:
+            the_run, solution_dir, answers, scaled = builds[built]
+            built.result()
+            measurements[the_run] = timers.submit(
+                measure_solution, solution_dir, answers, the_run[1], timing_lock, scaled, timings[the_run]
+            )
+
+    # Collect the results in submission order so that the output is deterministic.
+    results: dict[Run, Stats] = {}
+    for the_run, solution_dir, *_ in jobs:
+        lines, solution_counts, seconds = counted[the_run].result()
+        timings[the_run]["lines"] = seconds
+        # Forget files that have been deleted since they were last counted.
+        for key in solution_line_counts(counts, solution_dir):
+            del counts[key]
+        counts.update(solution_counts)
+        results[the_run] = (*measurements[the_run].result(), lines)
+    return results
+
+
+@cache
+def runtime_version(language: Language) -> str:
+    """Get the version of a language's toolchain."""
+    version = RUNTIMES[language].version
+    if not version:
+        return ""
+    result = run(" ".join(str(x) for x in version), shell=True, capture_output=True, text=True)
+    return (result.stdout + result.stderr).strip()
+
+
+def unignored_files(solution_dir: Path) -> set[str] | None:
+    """Get the paths, relative to a solution, of its files that git doesn't ignore, or None if git can't say."""
+    result = run(
+        ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+        cwd=solution_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        # For example, because the solutions aren't in a git repo.
+        return None
+    return set(filter(None, result.stdout.split("\0")))
+
+
+def source_chunks(solution_dir: Path) -> Generator[bytes, None, None]:
+    """Get a solution's source, but not what it builds or git ignores, to be hashed, with each file's path and size."""
+    unignored = unignored_files(solution_dir)
+    for root, dirs, files in os.walk(solution_dir):
+        # Sort, and prune, in place so that the walk is deterministic and skips build trees.
+        dirs[:] = sorted(x for x in dirs if x not in GENERATED)
+        for name in sorted(x for x in files if x not in GENERATED):
+            filepath = Path(root, name)
+            relative = filepath.relative_to(solution_dir).as_posix()
+            if unignored is not None and relative not in unignored:
+                continue
+            content = filepath.read_bytes()
+            yield f"{relative}\0{len(content)}\0".encode()
+            yield content
+
+
+def source_digest(solution_dir: Path, language: Language) -> Digest:
+    """Hash a solution's source and its toolchain version, which are what its build depends on."""
+    digest = hashlib.sha256(runtime_version(language).encode())
+    for chunk in source_chunks(solution_dir):
+        digest.update(chunk)
+    return digest.hexdigest()
 
 
-def main() -> None:
-    """Run the solutions."""
-    results: MutableMapping[Run, Stats] = {}
+def solution_digest(solution_dir: Path, language: Language) -> Digest:
+    """Hash a solution's source, its day's encrypted input and answers, and its toolchain version."""
+    digest = hashlib.sha256(runtime_version(language).encode())
+    for encrypted in ("input.gpg", "answers.gpg"):
+        digest.update((solution_dir.parent / encrypted).read_bytes())
+    for chunk in source_chunks(solution_dir):
+        digest.update(chunk)
+    return digest.hexdigest()
 
-    # Get the previous results.
-    # todo Refactor this into a function.
-    readme = Path("README.md")
-    old_content = readme.read_text()
-    section_begins = old_content.find("\n\n## Stats")
-    if section_begins > -1:
-        section_ends = old_content.find("\n\n##", section_begins + 1)
-        section = old_content[section_begins:section_ends] if section_ends else old_content[section_begins:]
-        results = from_table(section)
+
+def current_commit() -> str:
+    """Get the commit that is being measured, if we're in a git repo."""
+    result = run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def changed_since(base_ref: str) -> set[Path] | None:
+    """Get the solution directories, and days, with files that have changed since base_ref, or None if git can't say."""
+    result = run(
+        ["git", "diff", "--name-only", "--relative", "--no-renames", f"{base_ref}...HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        # For example, because the base ref isn't in a shallow clone.
+        print(f"Can't diff against {base_ref}, so checking every solution:", result.stderr.strip())
+        return None
+    changed: set[Path] = set()
+    for name in result.stdout.splitlines():
+        parts = Path(name).parts
+        if parts[0].startswith("day_"):
+            # A change to a day's input or answers is a change to all of its solutions.
+            changed.add(Path(*parts[:2]) if len(parts) > 2 else Path(parts[0]))
+    return changed
+
+
+def select_solutions(
+    store: MutableMapping[str, Record],
+    added: list[Record],
+    days: Collection[Day] = (),
+    languages: Collection[Language] = (),
+    people: Collection[Person] = (),
+    force: bool = False,
+    the_shard: tuple[int, int] | None = None,
+) -> dict[Path, list[tuple[Run, Path, Digest]]]:
+    """Choose the solutions to measure, with their digests, by day, as main would, adopting those from the README."""
+    base_ref = os.getenv("BASE_REF", "")
+    changed = changed_since(base_ref) if base_ref else None
 
     # Expecting
     # ├── day_01
     # │   ├── python_person
     # │   │   └── solution.py
+    selected: dict[Path, list[tuple[Run, Path, Digest]]] = {}
+    measurable = 0
     for day_dir in sorted(list(Path(".").glob("day_*"))):
         day: Day = day_dir.parts[0][4:]
-        answers = get_answers(day_dir)
-
         for solution_dir in sorted(list(day_dir.glob("*_*"))):
-            if ".optout" in set([x.name for x in solution_dir.iterdir() if x.is_file()]):
-                continue
             directory = solution_dir.parts[1]
             language, person = directory.split("_", maxsplit=1)
-            if (day, language, person) not in results and language in RUNTIMES:
-                with chdir(solution_dir):
-                    make_input_file()
-                    results[(day, language, person)] = (
-                        *measure_execution_time(answers, RUNTIMES[language]),
-                        count_lines(language),
-                    )
-
-    write_results(results)
-
-
-def make_input_file() -> None:
-    """Decrypt the input file."""
+            if language not in RUNTIMES or ".optout" in set([x.name for x in solution_dir.iterdir() if x.is_file()]):
+                continue
+            the_run, key = (day, language, person), solution_dir.as_posix()
+            if any(wanted and x not in wanted for x, wanted in zip(the_run, (days, languages, people), strict=True)):
+                continue
+            record = store.get(key)
+            settings = measurement_settings(language)
+            if (
+                not force
+                and changed is not None
+                and record is not None
+                and record.digest
+                and record.settings == settings
+                and not {day_dir, solution_dir} & changed
+            ):
+                # Untouched since the base ref, so there's no need to hash it.
+                continue
+            digest = solution_digest(solution_dir, language)
+            if not force and record is not None and record.digest == digest and record.settings == settings:
+                continue
+            if not force and record is not None and not record.digest:
+                # Measured before we kept a store, so trust the README.
+                store[key] = record._replace(digest=digest, settings=settings)
+                added.append(store[key])
+            else:
+                if the_shard is None or measurable % the_shard[1] == the_shard[0] - 1:
+                    selected.setdefault(day_dir, []).append((the_run, solution_dir, digest))
+                measurable += 1
+    return selected
+
+
+def main(
+    days: Collection[Day] = (),
+    languages: Collection[Language] = (),
+    people: Collection[Person] = (),
+    force: bool = False,
+    plan: bool = False,
+) -> None:
+    """Run the solutions, or only those for the given days, languages and people, if any are given."""
+    if os.getenv("MERGE_SHARDS", "false").lower() == "true":
+        merge_shards()
+        return
+    the_shard = shard()
+    store = read_store()
+    added: list[Record] = []
+    if not STORE.exists():
+        # Keep the results in the README from before we kept a store, even for solutions that no longer exist.
+        for the_run, stats in readme_results(Path("README.md").read_text()).items():
+            day, language, person = the_run
+            added.append(Record(f"day_{day}/{language}_{person}", the_run, "", stats))
+        store = {record.solution: record for record in added}
+    selected = select_solutions(store, added, days, languages, people, force, the_shard)
+    if plan:
+        print(
+            plan_report(
+                (the_run, store.get(solution_dir.as_posix()))
+                for pending in selected.values()
+                for the_run, solution_dir, _ in pending
+            )
+        )
+        return
+    line_counts = read_line_counts()
+
+    jobs: list[Job] = []
+    digests: dict[Run, tuple[str, Digest]] = {}
+    phases: dict[Run, dict[str, float]] = {}
+    # Decrypted inputs, and the links to them, are deleted when we're done, however that comes about.
+    with ExitStack() as inputs:
+        for day_dir, pending in selected.items():
+            day_phases: dict[str, float] = {}
+            with timing_phase(day_phases, "decrypt"):
+                answers = get_answers(day_dir)
+                input_file = inputs.enter_context(decrypted_input(day_dir))
+                scaled = inputs.enter_context(scaled_inputs(day_dir))
+            for the_run, solution_dir, digest in pending:
+                digests[the_run] = (solution_dir.as_posix(), digest)
+                phases[the_run] = {"decrypt": day_phases["decrypt"] / len(pending)}
+                inputs.callback((solution_dir / "input.txt").unlink, missing_ok=True)
+                jobs.append((the_run, solution_dir, answers, input_file, scaled))
+
+        score = machine_score()
+        print(f"Machine score: {score:.2f}")
+        timestamp, commit = datetime.now(UTC).isoformat(timespec="seconds"), current_commit()
+        metric, threshold = ranking_metric(), float(os.getenv("REGRESSION_THRESHOLD", "0.1"))
+        regressions: list[Regression] = []
+        for the_run, stats in run_solutions(jobs, line_counts, phases).items():
+            key, digest = digests[the_run]
+            version = runtime_version(the_run[1])
+            settings = measurement_settings(the_run[1])
+            record = Record(key, the_run, digest, stats, timestamp, commit, version, phases[the_run], score, settings)
+            if key in store:
+                regressions += find_regressions(store[key], record, metric, threshold)
+            store[key] = record
+            added.append(record)
+
+    if the_shard is None:
+        append_to_store(added)
+        write_line_counts(line_counts)
+        write_results({record.run: normalised(record) for record in store.values()})
+    else:
+        index, count = the_shard
+        shard_dir = SHARDS / f"{index}-of-{count}"
+        # Running a shard again replaces its results.
+        (shard_dir / "results.jsonl").unlink(missing_ok=True)
+        append_to_store(added, shard_dir / "results.jsonl")
+        # Only this shard's solutions' counts, as the others' may have been counted again by other shards.
+        shard_counts = {
+            key: x for _, solution_dir, *_ in jobs for key, x in solution_line_counts(line_counts, solution_dir).items()
+        }
+        write_line_counts(shard_counts, shard_dir / "lines.json")
+    report_machines(list(store.values()), score)
+    report_phases([record for record in added if record.phases])
+    report_counters([record for record in added if any(stat.counters for stat in record.stats[:2])])
+    report_regressions(regressions)
+
+
+def decrypt(encrypted: Path, output: Path | str = "-") -> str:
+    """Decrypt a file to output, returning the plaintext if output is stdout."""
     if (passphrase := os.getenv("GPG_PASS")) is None:
         raise ValueError("GPG_PASS environment variable not set.")
 
-    run(
-        [
-            "gpg",
-            "--batch",
-            "--yes",
-            "--passphrase",
-            passphrase,
-            "--decrypt",
-            "--output",
-            # Scripts expect input.txt to be in the CWD.
-            Path("input.txt"),
-            "../input.gpg",
-        ],
+    return run(
+        ["gpg", "--batch", "--yes", "--passphrase", passphrase, "--decrypt", "--output", output, encrypted],
         text=True,
         capture_output=True,
         check=True,
         timeout=10,
-    )
+    ).stdout
 
 
-def get_answers(dirpath: Path) -> tuple[str, str]:
-    """Get today's answers from the encrypted file."""
-    if (passphrase := os.getenv("GPG_PASS")) is None:
-        raise ValueError("GPG_PASS environment variable not set.")
+def input_directory() -> TemporaryDirectory[str]:
+    """Make a directory for inputs, which is deleted afterwards and kept in memory, on /dev/shm, unless they're cold."""
+    if input_cache() == "cold":
+        # Files in memory can't be taken out of the page cache, and the default temporary directory may be in memory.
+        return TemporaryDirectory(prefix=".advent_of_action_", dir=Path.cwd())
+    shm = Path("/dev/shm")
+    return TemporaryDirectory(prefix="advent_of_action_", dir=shm if os.access(shm, os.W_OK) else None)
 
-    run(
-        [
-            "gpg",
-            "--batch",
-            "--yes",
-            "--passphrase",
-            passphrase,
-            "--decrypt",
-            "--output",
-            Path("answers.txt"),
-            dirpath / "answers.gpg",
-        ],
-        text=True,
-        capture_output=True,
-        check=True,
-        timeout=10,
-    )
-    lines = Path("answers.txt").read_text().splitlines()
-    answers = lines[0], lines[1]
-    Path("answers.txt").unlink()
-    return answers
-
-
-def count_lines(language: str) -> int:
-    """Count the lines of code in the solution."""
-    extensions: Final = {
-        "python": "py",
-        "fsharp": "fsx",
-        "go": "go",
-        "haskell": "hs",
-        "ocaml": "ml",
-        "racket": "rkt",
-        "rust": "rs",
-        "jupyter": "ipynb",
-    }
 
-    summary = pygount.ProjectSummary()
-    for filepath in Path(".").rglob(f"*.{extensions[language]}"):
-        summary.add(pygount.SourceAnalysis.from_file(filepath, "pygount"))
+@contextmanager
+def decrypted_input(day_dir: Path) -> Generator[Path, None, None]:
+    """Decrypt a day's input, once, to a read-only file that is deleted afterwards."""
+    with input_directory() as tmp:
+        input_file = Path(tmp, "input.txt")
+        decrypt(day_dir / "input.gpg", input_file)
+        input_file.chmod(0o444)
+        yield input_file
 
-    return summary.total_code_count
+
+@contextmanager
+def scaled_inputs(day_dir: Path) -> Generator[tuple[Path, ...], None, None]:
+    """Get a day's scaled inputs, if SCALING is true, which are deleted afterwards unless they are in the repo."""
+    scaling = day_dir / "scaling"
+    if os.getenv("SCALING", "false").lower() != "true" or not scaling.is_dir():
+        yield ()
+        return
+    timeout = float(os.getenv("TIMEOUT_SECONDS", "60"))
+    with input_directory() as tmp:
+        inputs: list[Path] = []
+        try:
+            if (scaling / "generate").exists():
+                for size in os.getenv("SCALING_SIZES", "1000,10000,100000").split(","):
+                    inputs.append(Path(tmp, f"generated_{size.strip()}.txt"))
+                    with inputs[-1].open("w") as generated:
+                        generate = [(scaling / "generate").absolute(), size.strip()]
+                        run(generate, cwd=scaling, stdout=generated, check=True, timeout=timeout)
+            for encrypted in sorted(scaling.glob("*.gpg")):
+                inputs.append(Path(tmp, f"{encrypted.stem}.txt"))
+                decrypt(encrypted, inputs[-1])
+        except (CalledProcessError, TimeoutExpired) as e:
+            # Only name the command, as gpg's arguments include the passphrase.
+            print(f"Not scaling {day_dir.name}, as {Path(e.cmd[0]).name} failed or timed out making {inputs[-1].name}")
+            yield ()
+            return
+        for scaled in inputs:
+            scaled.chmod(0o444)
+        yield tuple(inputs + sorted(scaling.glob("*.txt")))
+
+
+def link_input(input_file: Path, directory: Path) -> None:
+    """Give a solution the day's input, as input.txt in its directory, without copying it."""
+    # Scripts expect input.txt to be in the CWD.
+    link = directory / "input.txt"
+    link.unlink(missing_ok=True)
+    try:
+        link.hardlink_to(input_file)
+    except OSError:
+        # Hard links can't cross filesystems, such as from /dev/shm.
+        link.symlink_to(input_file.absolute())
+
+
+def in_memory(path: Path) -> bool:
+    """Whether a file is on a filesystem in memory, such as tmpfs, as far as /proc/self/mounts (i.e. Linux) says."""
+    try:
+        mounts = Path("/proc/self/mounts").read_text().splitlines()
+    except OSError:
+        return False
+    # Spaces in mount points are escaped and, where one is mounted over another, the later mount is the one in use.
+    filesystems = {Path(point.replace("\\040", " ")): kind for _, point, kind, *_ in map(str.split, mounts)}
+    resolved = path.resolve()
+    mount = max((point for point in filesystems if resolved.is_relative_to(point)), key=lambda x: len(x.parts))
+    return filesystems[mount] in MEMORY_FILESYSTEMS
+
+
+def prepare_input(directory: Path, cache: str) -> str:
+    """Read a solution's input into the page cache (warm) or take it out (cold), returning which, if it has one."""
+    path = directory / "input.txt"
+    if not path.exists():
+        return ""
+    with path.open("rb") as input_file:
+        if cache == "cold":
+            if not hasattr(os, "posix_fadvise") or in_memory(path):
+                return ""
+            os.fsync(input_file.fileno())
+            os.posix_fadvise(input_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            return cache
+        buffer = bytearray(INPUT_CHUNK)
+        while input_file.readinto(buffer):
+            pass
+    return cache
+
+
+def get_answers(dirpath: Path) -> tuple[str, str]:
+    """Get today's answers from the encrypted file, without writing them to disk."""
+    lines = decrypt(dirpath / "answers.gpg").splitlines()
+    return lines[0], lines[1]
+
+
+def count_file(filepath: Path, known: FileCount | None = None) -> FileCount:
+    """Count the lines of code in a source file, unless it hasn't changed since they were last counted."""
+    stat = filepath.stat()
+    if known is not None and (known.size, known.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+        return known
+    content = filepath.read_bytes()
+    digest = hashlib.sha256(content).hexdigest()
+    if known is not None and known.digest == digest:
+        # Touched, for example by a fresh checkout, but not changed.
+        return known._replace(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    analysis = pygount.SourceAnalysis.from_file(filepath, "pygount")
+    return FileCount(stat.st_size, stat.st_mtime_ns, digest, analysis.code_count if analysis.is_countable else 0)
+
+
+def count_lines(
+    language: str, directory: Path = Path("."), counts: MutableMapping[str, FileCount] | None = None
+) -> linecount:
+    """Count the lines of code in the solution, re-using, and updating, the counts of any files counted before."""
+    known: MutableMapping[str, FileCount] = {} if counts is None else counts
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        # Prune, in place, so that we don't count build trees or other people's code.
+        dirs[:] = [x for x in dirs if x not in GENERATED | VENDORED]
+        for name in files:
+            if name.endswith(f".{EXTENSIONS[language]}"):
+                filepath = Path(root, name)
+                key = filepath.as_posix()
+                known[key] = count_file(filepath, known.get(key))
+                total += known[key].lines
+    return total
+
+
+def count_solution_lines(
+    language: Language, solution_dir: Path, counts: Mapping[str, FileCount]
+) -> tuple[linecount, dict[str, FileCount], float]:
+    """Count a solution's lines, in a worker process, returning them, its files' counts and how long it took."""
+    solution_counts: dict[str, FileCount] = {}
+    start = time.perf_counter()
+    # Reads fall through to the old counts, but only the files that are counted now are written.
+    lines = count_lines(language, solution_dir, ChainMap(solution_counts, dict(counts)))
+    return lines, solution_counts, time.perf_counter() - start
+
+
+def day_number(value: str) -> Day:
+    """Get a day, as in its day_xx directory, from its number (e.g. 1 or 01)."""
+    return f"{int(value):02d}"
+
+
+def cli(argv: Sequence[str] | None = None) -> None:
+    """Run main with the filters and options from the command line, which override their environment variables."""
+    parser = argparse.ArgumentParser(
+        prog="advent_of_action",
+        description="Time the solutions in the day_xx directories and write the results to the README.",
+        epilog="Anything else, such as GPG_PASS, is set by environment variables, as in action.yaml.",
+    )
+    parser.add_argument("--day", action="append", default=[], type=day_number, help="only run this day's solutions")
+    parser.add_argument(
+        "--language", action="append", default=[], choices=sorted(RUNTIMES), help="only run this language"
+    )
+    parser.add_argument("--person", action="append", default=[], help="only run this person's solutions")
+    parser.add_argument("--force", action="store_true", help="run solutions even if they haven't changed")
+    parser.add_argument("--jobs", type=int, help="the number of solutions to run at once (JOBS)")
+    parser.add_argument("--shard", help="only run this shard, i/N, of the solutions (SHARD)")
+    parser.add_argument("--merge-shards", action="store_true", help="merge the shards' results (MERGE_SHARDS)")
+    parser.add_argument("--plan", action="store_true", help="list what would be run, and estimate how long it'd take")
+    args = parser.parse_args(argv)
+    if args.jobs is not None:
+        os.environ["JOBS"] = str(args.jobs)
+    if args.shard is not None:
+        os.environ["SHARD"] = args.shard
+    if args.merge_shards:
+        os.environ["MERGE_SHARDS"] = "true"
+    # As the action's default timeout-seconds, for running locally.
+    os.environ.setdefault("TIMEOUT_SECONDS", "60")
+    main(set(args.day), set(args.language), set(args.person), args.force, args.plan)
 
 
 if __name__ == "__main__":
-    main()  # pragma: no cover
+    cli()  # pragma: no cover
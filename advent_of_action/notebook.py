@@ -0,0 +1,78 @@
+"""A lean runner for Jupyter notebooks, which doesn't start an IPython kernel unless a notebook needs one.
+
+Run with `python -m advent_of_action.notebook <notebook> [<part>]`, this compiles the notebook's code cells, or
+loads them from a cache of compiled notebooks, and then runs them with the part as the last argument. Without a
+part, it only compiles the notebook, which is what the setup does, so that compiling isn't timed.
+"""
+
+import builtins
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+from pathlib import Path
+from types import CodeType
+
+type Namespace = dict[str, object]
+
+
+def cached_code(notebook: Path) -> Path:
+    """Get where to cache the compiled notebook, which depends on its contents and the version of Python."""
+    digest = hashlib.sha256(importlib.util.MAGIC_NUMBER + notebook.read_bytes()).hexdigest()
+    return notebook.parent / "__pycache__" / f"{notebook.name}.{digest[:16]}.pyc"
+
+
+def compile_notebook(notebook: Path) -> CodeType:
+    """Compile a notebook's code cells, as IPython would run them, or load them if they have been compiled before."""
+    cache = cached_code(notebook)
+    if cache.exists():
+        return marshal.loads(cache.read_bytes())
+
+    import nbformat
+    from IPython.core.inputtransformer2 import TransformerManager
+
+    # Magics and shell escapes become calls to get_ipython().
+    transformer = TransformerManager()
+    cells = nbformat.read(notebook, as_version=4).cells
+    source = "\n".join(transformer.transform_cell(cell.source) for cell in cells if cell.cell_type == "code")
+    code = compile(source, str(notebook), "exec")
+
+    cache.parent.mkdir(exist_ok=True)
+    partial = cache.with_suffix(f".{os.getpid()}")
+    partial.write_bytes(marshal.dumps(code))
+    partial.replace(cache)
+    return code
+
+
+def uses_ipython(code: CodeType) -> bool:
+    """Whether compiled code, or any function in it, calls get_ipython, as magics and shell escapes do."""
+    return "get_ipython" in code.co_names or any(isinstance(x, CodeType) and uses_ipython(x) for x in code.co_consts)
+
+
+def namespace(notebook: Path, start_ipython: bool = False) -> Namespace:
+    """Make a namespace in which to run a notebook, which will only start IPython if the notebook uses it, or now."""
+    the_namespace: Namespace = {"__name__": "__main__", "__file__": str(notebook), "__builtins__": builtins}
+
+    def get_ipython() -> object:
+        from IPython.core.interactiveshell import InteractiveShell
+
+        return InteractiveShell.instance(user_ns=the_namespace)
+
+    the_namespace["get_ipython"] = get_ipython
+    if start_ipython:
+        get_ipython()
+    return the_namespace
+
+
+def main(argv: list[str]) -> None:
+    """Compile a notebook and, if given a part, run it."""
+    notebook = Path(argv[0])
+    code = compile_notebook(notebook)
+    if len(argv) > 1:
+        sys.argv = argv
+        exec(code, namespace(notebook))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])  # pragma: no cover
@@ -0,0 +1,272 @@
+"""Reports of the results, as the README's table and in the job summary, and of any regressions."""
+
+import itertools
+import math
+import os
+import statistics
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import Final, NamedTuple
+
+from advent_of_action.runners import Part
+from advent_of_action.store import PHASES, Record, Run, Stat, Stats
+
+
+class Regression(NamedTuple):
+    """A part that has got slower, or uses more memory, since its solution was last measured."""
+
+    run: Run
+    part: Part
+    column: str
+    before: float
+    after: float
+    # Whether the difference was tested for significance, which it can't be unless both were timed more than once.
+    tested: bool = True
+
+
+# Optional table columns, and the Stat fields they show, which are left out if no solution has a value for them.
+EXTRA_COLUMNS: Final = {
+    "norm (s)": "normalised_seconds",
+    "cpu (s)": "cpu_seconds",
+    "wall (s)": "wall_seconds",
+    "parallelism": "parallelism",
+    "startup (s)": "startup_seconds",
+    "min (s)": "min_seconds",
+    "stdev (s)": "stdev_seconds",
+    "runs": "runs",
+    "time growth": "time_growth",
+    "mem growth": "memory_growth",
+}
+
+# The counts in the hardware counter report, and their headings.
+COUNTERS: Final = {
+    "instructions": "instructions",
+    "cycles": "cycles",
+    "ipc": "IPC",
+    "cache_misses": "cache misses",
+    "branch_misses": "branch misses",
+    "page_faults": "page faults",
+}
+
+# How much slower, in seconds, or bigger, in MiB, a part must also be to regress, since tiny differences are noise.
+REGRESSION_FLOORS: Final = {"time (s)": 0.05, "mem (MiB)": 5.0}
+
+# How much faster, or slower, (as a fraction) than this one a machine must be for its results to be called out.
+MACHINE_TOLERANCE: Final = 0.2
+
+
+def from_table(table: str) -> dict[Run, Stats]:
+    """Extract results from the Markdown ##Stats section."""
+    results: dict[Run, Stats] = {}
+    part_one = None
+    rows = table.splitlines()
+    # Any optional columns come between the memory and the notes.
+    extras = [column.strip() for column in rows[4].split("|")[8:-2]]
+    for line in rows[6:]:
+        if not line:
+            break
+        cells = [cell.strip() for cell in line.split("|")[1:-1]]
+        day, lang, person, lines, part, seconds, kb = cells[:7]
+        stat = Stat(seconds, kb, cells[-1])._replace(
+            **{EXTRA_COLUMNS[column]: cell for column, cell in zip(extras, cells[7:-1], strict=True)}
+        )
+        if part == Part.ONE:
+            part_one = stat
+        elif part == Part.TWO:
+            assert part_one is not None
+            results[(day, lang, person)] = (part_one, stat, int(lines))
+        else:
+            raise ValueError(f"Unknown part {part}")
+
+    return results
+
+
+def to_table(results: Mapping[Run, Stats]) -> str:
+    """Convert results to a Markdown table."""
+    extras = [
+        column
+        for column, field in EXTRA_COLUMNS.items()
+        if any(stat._asdict()[field] for stats in results.values() for stat in stats[:2])
+    ]
+    table = "\n\n## Stats\n\n"
+    table += "| day | language | who | lines | part | time (s) | mem (MiB) | " + "".join(f"{x} | " for x in extras)
+    table += "notes |\n"
+    table += "| --- | --- | --- | ---: | --- | ---: | ---: | " + "---: | " * len(extras) + "--- |\n"
+    for the_run, stats in sorted(results.items()):
+        day, language, person = the_run
+        for stat, part in zip(stats[:2], (Part.ONE, Part.TWO), strict=False):
+            table += f"| {day} | {language} | {person} | {stats[2]} | {part} | {stat.seconds} | {stat.mebibytes} | "
+            table += "".join(f"{stat._asdict()[EXTRA_COLUMNS[x]]} | " for x in extras)
+            table += f"{stat.notes} |\n"
+    return table
+
+
+def stats_section(content: str) -> tuple[int, int]:
+    """Find where the Stats section of a README begins and ends, which is (-1, -1) if there isn't one."""
+    section_begins = content.find("\n\n## Stats")
+    if section_begins == -1:
+        return -1, -1
+    section_ends = content.find("\n##", section_begins + 10)
+    return section_begins, len(content) if section_ends == -1 else section_ends
+
+
+def readme_results(content: str) -> dict[Run, Stats]:
+    """Extract results from a README's Stats section, if it has one."""
+    section_begins, section_ends = stats_section(content)
+    return from_table(content[section_begins:section_ends]) if section_begins > -1 else {}
+
+
+def write_results(the_results: Mapping[Run, Stats]) -> None:
+    """Write results to the README, replacing its Stats section or, if it hasn't got one, adding one at the end."""
+    readme = Path("README.md")
+    old_content = readme.read_text()
+    section_begins, section_ends = stats_section(old_content)
+    if section_begins == -1:
+        section_begins = section_ends = len(old_content)
+    readme.write_text(old_content[:section_begins] + to_table(the_results) + old_content[section_ends:])
+
+
+def part_times(stat: Stat, metric: str) -> list[float]:
+    """Get the times of a part's timed runs or, if they weren't kept, its time, unless it didn't succeed."""
+    if not stat.seconds:
+        return []
+    return [getattr(x, metric) for x in stat.samples] or [float(stat.seconds)]
+
+
+def slower(before: Sequence[float], after: Sequence[float], threshold: float) -> bool:
+    """Whether the times after are more than threshold (as a fraction), and the floor, slower than before."""
+    if not before or not after:
+        return False
+    median_before, median_after = statistics.median(before), statistics.median(after)
+    if median_after <= (1 + threshold) * median_before or median_after - median_before < REGRESSION_FLOORS["time (s)"]:
+        return False
+    if len(before) < 2 or len(after) < 2:
+        return True
+    # Welch's t-test, at 95% confidence.
+    standard_error = math.sqrt(statistics.variance(before) / len(before) + statistics.variance(after) / len(after))
+    difference = statistics.mean(after) - statistics.mean(before)
+    return not standard_error or difference / standard_error > 1.96
+
+
+def find_regressions(before: Record, after: Record, metric: str, threshold: float) -> list[Regression]:
+    """Compare two measurements of a solution, part by part, for time and memory regressions, on one machine's scale."""
+    regressions: list[Regression] = []
+    scale = before.machine_score / after.machine_score if before.machine_score and after.machine_score else 1.0
+    for part, old, new in zip((Part.ONE, Part.TWO), before.stats[:2], after.stats[:2], strict=True):
+        old_times, new_times = [x * scale for x in part_times(old, metric)], part_times(new, metric)
+        if slower(old_times, new_times, threshold):
+            median_before, median_after = statistics.median(old_times), statistics.median(new_times)
+            tested = len(old_times) > 1 and len(new_times) > 1
+            regressions.append(Regression(after.run, part, "time (s)", median_before, median_after, tested))
+        if old.mebibytes and new.mebibytes:
+            old_mebibytes, new_mebibytes = float(old.mebibytes), float(new.mebibytes)
+            if (
+                new_mebibytes > (1 + threshold) * old_mebibytes
+                and new_mebibytes - old_mebibytes >= REGRESSION_FLOORS["mem (MiB)"]
+            ):
+                regressions.append(Regression(after.run, part, "mem (MiB)", old_mebibytes, new_mebibytes))
+    return regressions
+
+
+def regression_report(regressions: Sequence[Regression]) -> str:
+    """Describe regressions as a Markdown table, marking those that weren't tested for significance."""
+    report = "## Regressions\n\n"
+    report += "| day | language | who | part | column | before | after | change |\n"
+    report += "| --- | --- | --- | --- | --- | ---: | ---: | ---: |\n"
+    for regression in regressions:
+        day, language, person = regression.run
+        change = f"{regression.after / regression.before - 1:+.0%}" if regression.before else ""
+        change += "" if regression.tested else " †"
+        report += f"| {day} | {language} | {person} | {regression.part} | {regression.column} | "
+        report += f"{regression.before:.2f} | {regression.after:.2f} | {change} |\n"
+    if not all(x.tested for x in regressions):
+        report += "\n† Only timed once, before or after, so not tested for significance or failed on.\n"
+    return report
+
+
+def phase_report(records: Iterable[Record]) -> str:
+    """Describe where the time went, in each phase, for all solutions and by language and by person, as a table."""
+    totals: dict[tuple[str, str], dict[str, float]] = {}
+    for record in records:
+        _, language, person = record.run
+        for group in (("all", ""), ("language", language), ("who", person)):
+            total = totals.setdefault(group, {})
+            for phase, seconds in record.phases.items():
+                total[phase] = total.get(phase, 0.0) + seconds
+    phases = [phase for phase in PHASES if any(phase in total for total in totals.values())]
+    report = "## Time Spent\n\n"
+    report += "| by | name | " + "".join(f"{phase} (s) | " for phase in phases) + "total (s) |\n"
+    report += "| --- | --- | " + "---: | " * len(phases) + "---: |\n"
+    for (by, name), total in sorted(totals.items(), key=lambda x: (x[0][0] != "all", x[0])):
+        report += f"| {by} | {name} | " + "".join(f"{total.get(phase, 0.0):.2f} | " for phase in phases)
+        report += f"{sum(total.values()):.2f} |\n"
+    return report
+
+
+def publish(report: str) -> None:
+    """Print a report and, if we are running in GitHub Actions, add it to the job summary."""
+    print(report)
+    if summary := os.getenv("GITHUB_STEP_SUMMARY"):
+        with open(summary, "a") as summary_file:
+            summary_file.write(report)
+
+
+def report_phases(records: Sequence[Record]) -> None:
+    """Print a report of the time spent in each phase, if any solutions were measured, and add it to the job summary."""
+    if not records:
+        return
+    publish(phase_report(records))
+
+
+def counter_report(records: Iterable[Record]) -> str:
+    """Describe what perf stat counted for each part, as a Markdown table for each day."""
+    report = "## Hardware Counters\n"
+    for day, day_records in itertools.groupby(sorted(records, key=lambda x: x.run), key=lambda x: x.run[0]):
+        report += f"\n### Day {day}\n\n"
+        report += "| language | who | part | " + "".join(f"{x} | " for x in COUNTERS.values()) + "\n"
+        report += "| --- | --- | --- | " + "---: | " * len(COUNTERS) + "\n"
+        for record in day_records:
+            _, language, person = record.run
+            for part, stat in zip((Part.ONE, Part.TWO), record.stats[:2], strict=True):
+                if stat.counters:
+                    counts = ((x, stat.counters.get(x)) for x in COUNTERS)
+                    cells = ("" if x is None else f"{x:.2f}" if name == "ipc" else f"{x:,.0f}" for name, x in counts)
+                    report += f"| {language} | {person} | {part} | " + "".join(f"{x} | " for x in cells) + "\n"
+    return report
+
+
+def report_counters(records: Sequence[Record]) -> None:
+    """Print a report of the hardware counters of any parts that were counted, and add it to the job summary."""
+    if not records:
+        return
+    publish(counter_report(records))
+
+
+def machine_report(records: Iterable[Record], score: float) -> str:
+    """Describe results that were measured on other machines, and their machines' scores, as a Markdown table."""
+    report = "## Measured On Different Machines\n\n"
+    report += f"This machine scores {score:.2f}.\n\n"
+    report += "| day | language | who | score | commit |\n"
+    report += "| --- | --- | --- | ---: | --- |\n"
+    for record in sorted(records, key=lambda x: x.run):
+        day, language, person = record.run
+        report += f"| {day} | {language} | {person} | {record.machine_score:.2f} | {record.commit} |\n"
+    return report
+
+
+def report_machines(records: Sequence[Record], score: float) -> None:
+    """Warn about results from a materially different machine, whose times can only be compared once normalised."""
+    different = [x for x in records if x.machine_score and abs(x.machine_score / score - 1) > MACHINE_TOLERANCE]
+    if not different:
+        return
+    publish(machine_report(different, score))
+
+
+def report_regressions(regressions: Sequence[Regression]) -> None:
+    """Print a report of any regressions, and add it to the job summary, failing if FAIL_ON_REGRESSION is true."""
+    if not regressions:
+        return
+    publish(regression_report(regressions))
+    tested = [x for x in regressions if x.tested]
+    if tested and os.getenv("FAIL_ON_REGRESSION", "false").lower() == "true":
+        raise SystemExit(f"{len(tested)} regression(s) found.")
@@ -1,19 +1,48 @@
 """Runners for various programming languages."""
 
+import asyncio
+import codecs
+import ctypes
+import locale
 import os
+import resource
+import shlex
+import shutil
+import signal
 import subprocess
-from dataclasses import dataclass
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Generator, Iterable
+from contextlib import contextmanager, nullcontext, suppress
+from dataclasses import dataclass, field
 from enum import StrEnum
+from functools import cache
 from pathlib import Path
-from typing import Final
+from typing import IO, Final, NamedTuple
 
 type kilobytes = int
 type seconds = float
 type output = str
-type Triple = tuple[kilobytes, seconds, output]
 type command = list[str | Path]
 
 
+class Measurement(NamedTuple):
+    """The resources used by a command and what it printed."""
+
+    kibytes: kilobytes
+    # User plus system time.
+    cpu_seconds: seconds
+    stdout: output
+    wall_seconds: seconds
+    # Whether the command was held back by its sandbox's CPU limit.
+    throttled: bool = False
+    # How long the command took to print anything, or None if it didn't.
+    first_output_seconds: seconds | None = None
+
+
 class Part(StrEnum):
     """The parts of a day's solution."""
 
@@ -30,62 +59,466 @@ class Commands:
     setup: command
     run: command
     teardown: command
+    # Prints the toolchain version, which is part of what decides whether a solution needs re-running.
+    version: command = field(default_factory=list)
+    # Starts the runtime and does nothing, to time how long starting up takes.
+    startup: command = field(default_factory=list)
+    # The script to run in a warm runtime, if the language has one.
+    warm: str = ""
+    # The program that setup builds, and run runs, which is kept, and reused, until the source changes.
+    artifact: str = ""
+
+
+def cache_dir() -> Path:
+    """Get where to keep environments, builds and anything else that should outlive a run."""
+    return Path(os.getenv("CACHE_DIR", Path.home() / ".cache" / "advent_of_action"))
 
 
 FSHARP: Final = Commands(
     setup=[],
     run=["dotnet", "fsi", "solution.fsx", "{part}"],
     teardown=[],
+    version=["dotnet", "--version"],
+    startup=["dotnet", "fsi", "--quiet", "--exec"],
 )
 GOLANG: Final = Commands(
     setup=["go", "build", "."],
     run=["./solution", "{part}"],
     teardown=[],
+    version=["go", "version"],
+    artifact="solution",
 )
 HASKELL: Final = Commands(
     setup=["cabal", "build"],
     run=["$(cabal list-bin solution)", "{part}"],
     teardown=[],
+    version=["ghc", "--numeric-version"],
 )
 
-JUPYTER: Final = Commands(setup=[], run=["ipython", "-c", "'%run solution.ipynb'", "{part}"], teardown=[])
+JUPYTER: Final = Commands(
+    # Compiles the notebook, so that it isn't parsed each time it is run.
+    setup=["python", "-m", "advent_of_action.notebook", "solution.ipynb"],
+    run=["python", "-m", "advent_of_action.notebook", "solution.ipynb", "{part}"],
+    teardown=[],
+    version=["ipython", "--version"],
+    # Everything but running the notebook's code.
+    startup=["python", "-m", "advent_of_action.notebook", "solution.ipynb"],
+    warm="solution.ipynb",
+)
 OCAML: Final = Commands(
     setup=[],
     run=["ocaml", "solution.ml", "{part}"],
     teardown=[],
+    version=["ocaml", "-version"],
+    startup=["ocaml", "/dev/null"],
 )
 PYTHON: Final = Commands(
-    setup=["pip", "install", "-q", "-q", "-q", "--no-input", "-r", "requirements.txt"],
-    run=["python", "solution.py", "{part}"],
-    teardown=["pip", "uninstall", "-q", "-q", "-q", "--no-input", "--yes", "-r", "requirements.txt"],
+    # Links .venv to an environment with the solution's requirements, if it has any.
+    setup=["python", "-m", "advent_of_action.venvs"],
+    run=["PATH=.venv/bin:$PATH", "python", "solution.py", "{part}"],
+    teardown=["rm", "-f", ".venv"],
+    version=["python", "--version"],
+    startup=["PATH=.venv/bin:$PATH", "python", "-c", "pass"],
+    warm="solution.py",
 )
 
 RACKET: Final = Commands(
     setup=[],
     run=["racket", "solution.rkt", "{part}"],
     teardown=[],
+    version=["racket", "--version"],
+    startup=["racket", "-l", "racket/base", "-e", "''"],
 )
 RUST: Final = Commands(
     setup=["cargo", "build", "--quiet", "--release"],
     run=["./target/release/solution", "{part}"],
     teardown=[],
+    version=["rustc", "--version"],
+    artifact="target/release/solution",
 )
 
 
-def execute_command(cmd: command, part: Part | None = None, timeout: float | None = None) -> Triple:
-    """Execute a command and return the memory usage, time and stdout."""
+@dataclass(frozen=True)
+class Sandbox:
+    """A cgroup (v2) in which to make a cgroup for each command, and the limits to give them."""
+
+    root: Path
+    # None for no limit.
+    memory_mebibytes: int | None = None
+    cpus: float | None = None
+
+
+class OutOfMemory(subprocess.CalledProcessError):
+    """Raised when a command is killed for using more memory than its sandbox allows."""
+
+
+# The period over which a sandbox's CPU limit is applied.
+CPU_PERIOD_MICROSECONDS: Final = 100_000
+
+# The most characters of a command's stdout, or stderr, to keep, so that a chatty solution can't use up our memory.
+MAX_CAPTURED: Final = 1024 * 1024
+
+# How long to keep reading a command's output once it has exited, and anything it left running has been killed.
+PIPE_GRACE_SECONDS: Final = 1.0
+
+# The most characters to read from a pipe at once.
+CHUNK: Final = 64 * 1024
+
+# From linux/prctl.h.
+PR_SET_CHILD_SUBREAPER: Final = 36
+
+
+@cache
+def become_subreaper() -> bool:
+    """Adopt any orphaned descendants, so that we can reap commands that a shell has started and left behind."""
+    if sys.platform != "linux":
+        return False
+    return ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+
+
+def spawn(cmd_str: str, cwd: Path | None) -> tuple[subprocess.Popen[str], int]:
+    """Start a shell command, returning the shell and the process to reap for the command's resource usage.
+
+    A process's peak memory includes that of the process it was forked from, which would be us, so the shell forks
+    the command and then replaces itself with echo, to tell us the command's process ID, leaving us to reap the
+    command. That way, the peak memory includes only that of the (small) shell. If we can't become a subreaper, we
+    reap the shell instead.
+    """
+    if not become_subreaper():
+        process = subprocess.Popen(
+            cmd_str,
+            shell=True,
+            text=True,
+            cwd=cwd,
+            start_new_session=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        return process, process.pid
+
+    read_fd, write_fd = os.pipe()
+    # The shell mustn't reap the command itself, which it might if it were still running when the command exits.
+    shell = subprocess.Popen(
+        f"{{ {cmd_str}\n}} & exec echo $! >/dev/fd/{write_fd}",
+        shell=True,
+        text=True,
+        cwd=cwd,
+        start_new_session=True,
+        pass_fds=(write_fd,),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pid_pipe:
+        pid = pid_pipe.readline().strip()
+    if not pid:
+        # The shell couldn't start the command (e.g. because of a syntax error), so we reap the shell.
+        return shell, shell.pid
+    shell.wait()
+    return shell, int(pid)
+
+
+def kill_group(process_group: int, killed: threading.Event) -> None:
+    """Kill a command, and everything it started, for example because it has run out of time, and note that we did."""
+    killed.set()
+    with suppress(ProcessLookupError):
+        os.killpg(process_group, signal.SIGKILL)
+
+
+class CappedOutput:
+    """What a command printed, of which only the first and last MAX_CAPTURED / 2 characters are kept.
+
+    If the command prints much more than an answer, the start of stdout is what we compare with the answer and the
+    end of stderr is where the error will be.
+    """
+
+    def __init__(self) -> None:
+        """Start with nothing."""
+        self.head: list[str] = []
+        self.tail: deque[str] = deque()
+        self.head_size = self.tail_size = self.dropped = 0
+
+    def add(self, chunk: str) -> None:
+        """Keep a chunk, at least until the tail is full."""
+        if self.head_size < MAX_CAPTURED // 2:
+            self.head.append(chunk)
+            self.head_size += len(chunk)
+            return
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        while self.tail_size > MAX_CAPTURED // 2:
+            oldest = self.tail.popleft()
+            self.tail_size -= len(oldest)
+            self.dropped += len(oldest)
+
+    def __str__(self) -> str:
+        """Get what was kept, noting how much wasn't."""
+        gap = f"\n[{self.dropped} characters not kept]\n" if self.dropped else ""
+        return "".join(self.head) + gap + "".join(self.tail)
+
+
+async def read_capped(
+    pipe: IO[str], watch: Callable[[str], None] | None = None, captured: CappedOutput | None = None
+) -> str:
+    """Read a pipe, as it is written to, until it is closed, passing each chunk to watch, if given.
+
+    The event loop reads the pipe's file descriptor, and closes the pipe at the end, or if reading is cancelled.
+    What has been read is kept in captured, if given, so that it isn't lost if reading is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    # As Popen would have decoded it.
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+    captured = CappedOutput() if captured is None else captured
+    try:
+        while data := await reader.read(CHUNK):
+            chunk = decoder.decode(data)
+            if watch is not None:
+                watch(chunk)
+            captured.add(chunk)
+    finally:
+        transport.close()
+    captured.add(decoder.decode(b"", final=True))
+    return str(captured)
+
+
+async def finish_reading(readers: Iterable[asyncio.Task[str]]) -> None:
+    """Give pipe readers PIPE_GRACE_SECONDS to read to the end, then stop them.
+
+    A process that has left the command's process group, such as a build server, can hold its pipes open forever.
+    """
+    _, pending = await asyncio.wait(readers, timeout=PIPE_GRACE_SECONDS)
+    for reader in pending:
+        reader.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def reap(pid: int) -> tuple[int, int, resource.struct_rusage]:
+    """Wait for a child process to exit, without blocking the event loop, then reap it with wait4.
+
+    Where there are no pidfds (i.e. outside Linux), a thread waits instead.
+    """
+    if not hasattr(os, "pidfd_open"):
+        return await asyncio.to_thread(os.wait4, pid, 0)
+    loop = asyncio.get_running_loop()
+    exited: asyncio.Future[None] = loop.create_future()
+    pidfd = os.pidfd_open(pid)
+    # A pidfd becomes readable when its process exits.
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    return os.wait4(pid, 0)
+
+
+class StdoutWatcher:
+    """Watches a command's stdout as it is read, noting when it starts and stopping the command if it is wrong."""
+
+    def __init__(self, process_group: int, start_ns: int, answer: str | None = None) -> None:
+        """Watch the command whose process group is given, which was started at start_ns."""
+        self.process_group = process_group
+        self.start_ns = start_ns
+        # Only a one-line answer can be checked before the command has finished.
+        self.answer: str | None = answer if answer is not None and "\n" not in answer else None
+        self.first_output_ns: int | None = None
+        self.first_line = ""
+        self.wrong = threading.Event()
+
+    def __call__(self, chunk: str) -> None:
+        """Note when the first output arrives and, as soon as we can tell, whether the first line is the answer."""
+        if self.first_output_ns is None:
+            self.first_output_ns = time.perf_counter_ns() - self.start_ns
+        answer = self.answer
+        if answer is None:
+            return
+        # Blank lines before the answer are ignored, as are any spaces around it, just as they are afterwards.
+        self.first_line = (self.first_line + chunk).lstrip()
+        line, newline, _ = self.first_line.partition("\n")
+        if newline or len(line.rstrip()) > len(answer):
+            self.answer = None
+            if line.rstrip() != answer:
+                kill_group(self.process_group, self.wrong)
+
+
+@contextmanager
+def cgroup(sandbox: Sandbox) -> Generator[Path, None, None]:
+    """Make a cgroup, with the sandbox's limits, for one command and remove it, and anything left in it, afterwards."""
+    path = Path(tempfile.mkdtemp(prefix="run_", dir=sandbox.root))
+    try:
+        if sandbox.memory_mebibytes is not None:
+            (path / "memory.max").write_text(str(sandbox.memory_mebibytes * 1024 * 1024))
+            # Only there if the kernel accounts for swap.
+            if (path / "memory.swap.max").exists():
+                (path / "memory.swap.max").write_text("0")
+            # Kill the whole command, not just its largest process, if it runs out of memory.
+            (path / "memory.oom.group").write_text("1")
+        if sandbox.cpus is not None:
+            quota = round(sandbox.cpus * CPU_PERIOD_MICROSECONDS)
+            (path / "cpu.max").write_text(f"{quota} {CPU_PERIOD_MICROSECONDS}")
+        yield path
+    finally:
+        # Processes take a moment to die, and a cgroup can't be removed until they have.
+        with suppress(OSError):
+            (path / "cgroup.kill").write_text("1")
+        for _ in range(100):
+            try:
+                path.rmdir()
+                break
+            except OSError:
+                time.sleep(0.01)
+
+
+def read_counters(path: Path) -> dict[str, int]:
+    """Read a cgroup file of "name value" lines, such as cpu.stat, or nothing if the controller isn't enabled."""
+    if not path.exists():
+        return {}
+    return {name: int(value) for name, value in (line.split() for line in path.read_text().splitlines())}
+
+
+# The events that perf stat counts, and the names we keep their counts under.
+PERF_EVENTS: Final = {
+    "instructions": "instructions",
+    "cycles": "cycles",
+    "cache-misses": "cache_misses",
+    "branch-misses": "branch_misses",
+    "page-faults": "page_faults",
+}
+
+
+@cache
+def perf_available() -> bool:
+    """Whether perf is installed and we are allowed (by perf_event_paranoid) to count the events of our commands."""
+    if shutil.which("perf") is None:
+        return False
+    check = ["perf", "stat", "-x,", "-e", ",".join(PERF_EVENTS), "--", "true"]
+    return subprocess.run(check, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+
+def perf_command(cmd: command, output: Path) -> command:
+    """Wrap a command in perf stat, which writes its counts to output, as CSV, once the command has finished."""
+    wrapped = shlex.quote(" ".join(str(x) for x in cmd))
+    return ["perf", "stat", "-x,", "-o", output, "-e", ",".join(PERF_EVENTS), "--", "sh", "-c", wrapped]
+
+
+def read_perf_stat(text: str) -> dict[str, float]:
+    """Read perf stat's CSV output, leaving out events that weren't counted (e.g. hardware events in a VM).
+
+    Events may have a modifier, such as instructions:u if we may only count user space, and on CPUs with more than
+    one kind of core, an event is counted for each kind, as cpu_core/instructions/ and so on, which we add up.
+    """
+    counts: dict[str, float] = {}
+    for line in text.splitlines():
+        fields = line.split(",")
+        if line.startswith("#") or len(fields) < 3:
+            continue
+        value, event = fields[0], fields[2].split(":")[0]
+        event = event.split("/")[1] if event.count("/") == 2 else event
+        if event in PERF_EVENTS and value.isdigit():
+            name = PERF_EVENTS[event]
+            counts[name] = counts.get(name, 0) + int(value)
+    return counts
+
+
+async def execute_command_async(
+    cmd: command,
+    part: Part | None = None,
+    timeout: float | None = None,
+    cwd: Path | None = None,
+    sandbox: Sandbox | None = None,
+    answer: str | None = None,
+) -> Measurement:
+    """Execute a command, in cwd if given, and return the memory usage, times and stdout."""
     if timeout is None:
         timeout = float(os.environ["TIMEOUT_SECONDS"])
-    cmd_str = " ".join(str(x) for x in ["/usr/bin/time", "-f", "%M,%S,%U"] + cmd)
+    cmd_str = " ".join(str(x) for x in cmd)
     print("Running", cmd)
-    result = subprocess.run(
-        cmd_str.format(part=part) if part else cmd_str,
-        capture_output=True,
-        text=True,
-        check=True,
-        shell=True,
-        timeout=timeout,
-    )
+    cmd_str = cmd_str.format(part=part) if part else cmd_str
+
+    timed_out, cancelled = threading.Event(), threading.Event()
+    with nullcontext(None) if sandbox is None else cgroup(sandbox) as group:
+        # The command moves itself into the cgroup, so that everything it starts will be in there too.
+        script = (
+            cmd_str if group is None else f"echo 0 >{shlex.quote(str(group / 'cgroup.procs'))} || exit 1\n{cmd_str}"
+        )
+        start = time.perf_counter_ns()
+        # Not with asyncio's subprocess functions, which reap what they start, losing its resource usage.
+        shell, pid = spawn(script, cwd)
+        with shell:
+            out_pipe, err_pipe = shell.stdout, shell.stderr
+            assert out_pipe is not None and err_pipe is not None
+            # The shell leads the command's process group.
+            watcher = StdoutWatcher(shell.pid, start, answer)
+            # Read both pipes as we go, so that neither can fill up and block the command.
+            out_captured, err_captured = CappedOutput(), CappedOutput()
+            readers = (
+                asyncio.create_task(read_capped(out_pipe, watcher, out_captured)),
+                asyncio.create_task(read_capped(err_pipe, captured=err_captured)),
+            )
+            reaped = asyncio.create_task(reap(pid))
+            try:
+                async with asyncio.timeout(timeout):
+                    # Shielded, so that the command is still reaped if we time out.
+                    await asyncio.shield(reaped)
+            except TimeoutError:
+                kill_group(shell.pid, timed_out)
+            except asyncio.CancelledError:
+                kill_group(shell.pid, cancelled)
+                await reaped
+                await finish_reading(readers)
+                raise
+            _, status, usage = await reaped
+            wall_ns = time.perf_counter_ns() - start
+            returncode = os.waitstatus_to_exitcode(status)
+            if shell.returncode is None:
+                # We have reaped the shell ourselves, so let Popen know not to.
+                shell.returncode = returncode
+            # Anything the command left running (e.g. in the background) could otherwise hold its pipes open.
+            kill_group(shell.pid, threading.Event())
+            await finish_reading(readers)
+            output, errors = str(out_captured), str(err_captured)
+
+        # ru_maxrss is in bytes on macOS but kibibytes on Linux.
+        kibytes = usage.ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+        cpu_stat: dict[str, int] = {}
+        memory_events: dict[str, int] = {}
+        if group is not None:
+            cpu_stat = read_counters(group / "cpu.stat")
+            memory_events = read_counters(group / "memory.events")
+            cpu_seconds = cpu_stat["usage_usec"] / 1e6
+            # Only there if the memory controller is enabled.
+            if (group / "memory.peak").exists():
+                kibytes = int((group / "memory.peak").read_text()) // 1024
+
+    first_output_ns = watcher.first_output_ns
+    first_output_seconds = None if first_output_ns is None else first_output_ns / 1e9
+    if watcher.wrong.is_set():
+        return Measurement(
+            kibytes, cpu_seconds, output.strip(), wall_ns / 1e9, first_output_seconds=first_output_seconds
+        )
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd_str, timeout, output=output, stderr=errors)
+    if memory_events.get("oom_kill", 0):
+        raise OutOfMemory(returncode, cmd_str, output=output, stderr=errors)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd_str, output=output, stderr=errors)
+
+    throttled = cpu_stat.get("nr_throttled", 0) > 0
+    return Measurement(kibytes, cpu_seconds, output.strip(), wall_ns / 1e9, throttled, first_output_seconds)
+
 
-    kilobytes, sys_seconds, user_seconds = result.stderr.splitlines()[-1].split(",")
-    return int(kilobytes), float(sys_seconds) + float(user_seconds), result.stdout.strip()
+def execute_command(
+    cmd: command,
+    part: Part | None = None,
+    timeout: float | None = None,
+    cwd: Path | None = None,
+    sandbox: Sandbox | None = None,
+    answer: str | None = None,
+) -> Measurement:
+    """Execute a command, as execute_command_async does, in an event loop of its own."""
+    return asyncio.run(execute_command_async(cmd, part, timeout, cwd, sandbox, answer))
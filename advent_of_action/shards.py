@@ -0,0 +1,103 @@
+"""Splitting the solutions to measure between several runs, planning them and merging their results."""
+
+import os
+import shutil
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Final
+
+from advent_of_action.reports import write_results
+from advent_of_action.store import (
+    Record,
+    Run,
+    append_to_store,
+    from_json,
+    normalised,
+    read_line_counts,
+    read_store,
+    solution_line_counts,
+    write_line_counts,
+)
+
+# Where each shard keeps its results, and line counts, as i-of-N/results.jsonl and i-of-N/lines.json, until merged.
+SHARDS: Final = Path(".advent_of_action/shards")
+
+
+def shard() -> tuple[int, int] | None:
+    """Get which shard, i of N, this run is from SHARD (e.g. 1/4), if it is one."""
+    value = os.getenv("SHARD", "")
+    if not value:
+        return None
+    index, _, count = value.partition("/")
+    if not (index.isdigit() and count.isdigit() and 1 <= int(index) <= int(count)):
+        raise ValueError(f"SHARD should be i/N, with i from 1 to N, not {value}.")
+    return int(index), int(count)
+
+
+def estimate(record: Record | None) -> float | None:
+    """Estimate how long measuring a solution again will take, from how long it took last time, if we know."""
+    if record is None:
+        return None
+    if record.phases:
+        return sum(record.phases.values())
+    one, two, _ = record.stats
+    # Measured before we kept phases, so all we have are the parts' times, or that they timed out.
+    timeout = float(os.getenv("TIMEOUT_SECONDS", "60"))
+    times = [float(x.seconds) if x.seconds else timeout if x.notes == "Timeout" else 0.0 for x in (one, two)]
+    return sum(times) or None
+
+
+def plan_report(planned: Iterable[tuple[Run, Record | None]]) -> str:
+    """Describe the solutions that would be measured, and how long each might take, as a Markdown table."""
+    report = "## Plan\n\n"
+    report += "| day | language | who | last measured | estimate (s) |\n"
+    report += "| --- | --- | --- | --- | ---: |\n"
+    total, unknown = 0.0, 0
+    for the_run, record in sorted(planned, key=lambda x: x[0]):
+        day, language, person = the_run
+        seconds = estimate(record)
+        last = "never" if record is None else record.timestamp or "before the store"
+        report += f"| {day} | {language} | {person} | {last} | {'' if seconds is None else f'{seconds:.2f}'} |\n"
+        total, unknown = total + (seconds or 0.0), unknown + (seconds is None)
+    report += f"\nAbout {total:.2f} seconds in all"
+    report += f", plus however long the {unknown} without an estimate take.\n" if unknown else ".\n"
+    return report
+
+
+def shard_directories() -> list[Path]:
+    """Get the directories of every shard, i of N for i from 1 to N, in SHARDS, exiting if any are missing or odd."""
+    directories: dict[int, Path] = {}
+    counts: set[int] = set()
+    for directory in SHARDS.iterdir() if SHARDS.is_dir() else ():
+        index, _, count = directory.name.partition("-of-")
+        if not (index.isdigit() and count.isdigit()):
+            raise SystemExit(f"{directory} isn't a shard, which would be named i-of-N.")
+        directories[int(index)] = directory
+        counts.add(int(count))
+    if not counts:
+        raise SystemExit(f"There are no shards in {SHARDS} to merge.")
+    if len(counts) > 1:
+        raise SystemExit(f"The shards in {SHARDS} are from runs split {len(counts)} different ways.")
+    (count,) = counts
+    if missing := sorted(set(range(1, count + 1)) - set(directories)):
+        raise SystemExit(f"Shard(s) {', '.join(str(x) for x in missing)} of {count} are missing from {SHARDS}.")
+    return [directories[x] for x in range(1, count + 1)]
+
+
+def merge_shards() -> None:
+    """Add every shard's results to the store, and line counts to ours, write the README and remove the shards."""
+    records: dict[str, Record] = {}
+    line_counts = read_line_counts()
+    for directory in shard_directories():
+        for line in (directory / "results.jsonl").read_text().splitlines():
+            # Results from the README, from before we kept a store, are in every shard, so are only added once.
+            record = records.setdefault(line, from_json(line))
+            if record.timestamp:
+                # Forget files that have been deleted since they were last counted.
+                for key in solution_line_counts(line_counts, Path(record.solution)):
+                    del line_counts[key]
+        line_counts.update(read_line_counts(directory / "lines.json"))
+    append_to_store(records.values())
+    write_line_counts(line_counts)
+    write_results({record.run: normalised(record) for record in read_store().values()})
+    shutil.rmtree(SHARDS)
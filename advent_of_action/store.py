@@ -0,0 +1,232 @@
+"""The results store, which keeps every measurement of every solution, and the line counts of their files."""
+
+import json
+import os
+import statistics
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import Final, NamedTuple
+
+from advent_of_action.runners import Measurement
+
+type Day = str
+type Language = str
+type Person = str
+type Seconds = str
+type MiBytes = str
+type Notes = str
+type Run = tuple[Day, Language, Person]
+type linecount = int
+type Digest = str
+
+
+class Sample(NamedTuple):
+    """One timed run of a part, without its output, which may be an answer."""
+
+    cpu_seconds: float
+    wall_seconds: float
+    kibytes: int
+    first_output_seconds: float | None = None
+
+    @classmethod
+    def of(cls, measurement: Measurement) -> "Sample":
+        """Keep what we need of a measurement."""
+        return cls(
+            measurement.cpu_seconds, measurement.wall_seconds, measurement.kibytes, measurement.first_output_seconds
+        )
+
+
+class Stat(NamedTuple):
+    """The measurements of one part of a solution."""
+
+    seconds: Seconds
+    mebibytes: MiBytes
+    notes: Notes
+    # Only set if the part was timed more than once, in which case seconds is the median.
+    min_seconds: Seconds = ""
+    stdev_seconds: Seconds = ""
+    runs: str = ""
+    # Seconds is one of these, depending on the RANKING_METRIC.
+    cpu_seconds: Seconds = ""
+    wall_seconds: Seconds = ""
+    # CPU time over wall time, which is more than one if a solution uses several cores at once.
+    parallelism: str = ""
+    # How long the language's runtime takes to start, which isn't included in seconds if it was warm.
+    startup_seconds: Seconds = ""
+    # Every timed run, which are kept in the results store but not shown in the table.
+    samples: tuple[Sample, ...] = ()
+    # How the time and peak memory grow with the size of the input (e.g. 2.00 for quadratic), if it was scaled.
+    time_growth: str = ""
+    memory_growth: str = ""
+    # What perf stat counted in one more run of the part, such as its instructions and cycles, if PERF_COUNTERS is set.
+    counters: Mapping[str, float] = {}
+    # Seconds multiplied by the score of the machine it was measured on, so that it can be compared across machines.
+    normalised_seconds: Seconds = ""
+    # Whether the input was in the page cache (warm) or not (cold) when the part was timed, as set by INPUT_CACHE.
+    input_cache: str = ""
+
+
+type Stats = tuple[Stat, Stat, linecount]
+
+
+class FileCount(NamedTuple):
+    """The lines of code in one source file, and what we need to tell whether it has changed since they were counted."""
+
+    size: int
+    mtime_ns: int
+    digest: Digest
+    lines: linecount
+
+
+class Record(NamedTuple):
+    """One measurement of a solution, as kept in the results store."""
+
+    solution: str
+    run: Run
+    digest: Digest
+    stats: Stats
+    # Empty for results from the README that were measured before we kept a results store.
+    timestamp: str = ""
+    commit: str = ""
+    version: str = ""
+    # The wall-clock seconds spent in each of the PHASES that the solution went through.
+    phases: Mapping[str, float] = {}
+    # How fast the machine that measured the solution was, relative to the reference machine, or 0 if not known.
+    machine_score: float = 0.0
+    # The settings that the solution was measured with, which it is measured again if they change.
+    settings: Mapping[str, str] = {}
+
+
+# Every measurement of every solution, one JSON record per line, of which the last for each solution is current.
+STORE: Final = Path(".advent_of_action/results.jsonl")
+
+# The lines of code in every source file counted so far, keyed by path.
+LINE_COUNTS: Final = Path(".advent_of_action/lines.json")
+
+# What measuring a solution takes time for. Decrypting is per day, so each of the day's solutions gets a share of it.
+PHASES: Final = ("decrypt", "setup", "one", "two", "counters", "scaling", "startup", "teardown", "lines")
+
+# The times that solutions can be ranked by, and the Measurement fields they come from.
+RANKING_METRICS: Final = {"cpu": "cpu_seconds", "wall": "wall_seconds"}
+
+
+def ranking_metric() -> str:
+    """Get the Measurement field, CPU or wall-clock time, given by the RANKING_METRIC."""
+    metric = os.getenv("RANKING_METRIC", "cpu")
+    if metric not in RANKING_METRICS:
+        raise ValueError(f"RANKING_METRIC should be one of {', '.join(RANKING_METRICS)}, not {metric}.")
+    return RANKING_METRICS[metric]
+
+
+def to_json(record: Record) -> str:
+    """Serialise a record as one line of JSON."""
+    day, language, person = record.run
+    one, two, lines = record.stats
+    return json.dumps(
+        {
+            "solution": record.solution,
+            "day": day,
+            "language": language,
+            "person": person,
+            "digest": record.digest,
+            "timestamp": record.timestamp,
+            "commit": record.commit,
+            "version": record.version,
+            "lines": lines,
+            "one": one._asdict(),
+            "two": two._asdict(),
+            "phases": dict(record.phases),
+            "machine_score": record.machine_score,
+            "settings": dict(record.settings),
+        },
+        sort_keys=True,
+    )
+
+
+def from_json(line: str) -> Record:
+    """Deserialise a record from a line of JSON."""
+    entry = json.loads(line)
+    one, two = (
+        Stat(**{**entry[part], "samples": tuple(Sample(*x) for x in entry[part].get("samples", []))})
+        for part in ("one", "two")
+    )
+    return Record(
+        entry["solution"],
+        (entry["day"], entry["language"], entry["person"]),
+        entry["digest"],
+        (one, two, entry["lines"]),
+        entry["timestamp"],
+        entry["commit"],
+        entry["version"],
+        entry.get("phases", {}),
+        entry.get("machine_score", 0.0),
+        entry.get("settings", {}),
+    )
+
+
+def read_store() -> dict[str, Record]:
+    """Read the current record of each solution, which is the last one in the store."""
+    records: dict[str, Record] = {}
+    if STORE.exists():
+        with STORE.open() as lines:
+            for line in lines:
+                record = from_json(line)
+                records[record.solution] = record
+    return records
+
+
+def append_to_store(records: Iterable[Record], path: Path | None = None) -> None:
+    """Add records to the end of the store, or of path, so that updating a solution doesn't mean rewriting others."""
+    path = STORE if path is None else path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as store:
+        store.writelines(to_json(record) + "\n" for record in records)
+
+
+def ranked(stat: Stat, metric: str) -> Stat:
+    """Get a part's stat with the time, and spread, of metric, rather than of the metric it was measured with."""
+    seconds = getattr(stat, metric)
+    if not seconds:
+        # From the README, from before we kept both times, or the part didn't succeed.
+        return stat
+    times = [getattr(x, metric) for x in stat.samples]
+    if len(times) < 2:
+        return stat._replace(seconds=seconds)
+    return stat._replace(
+        seconds=seconds, min_seconds=f"{min(times):.2f}", stdev_seconds=f"{statistics.stdev(times):.2f}"
+    )
+
+
+def normalised(record: Record) -> Stats:
+    """Get a record's stats as the README shows them, ranked by RANKING_METRIC and normalised, if we can."""
+    one, two, lines = record.stats
+    one, two = (ranked(stat, ranking_metric()) for stat in (one, two))
+    if not record.machine_score:
+        return one, two, lines
+    one, two = (
+        stat._replace(normalised_seconds=f"{float(stat.seconds) * record.machine_score:.2f}") if stat.seconds else stat
+        for stat in (one, two)
+    )
+    return one, two, lines
+
+
+def solution_line_counts(counts: Mapping[str, FileCount], solution_dir: Path) -> dict[str, FileCount]:
+    """Get the counts of the files in one solution's directory."""
+    prefix = f"{solution_dir.as_posix()}/"
+    return {key: count for key, count in counts.items() if key.startswith(prefix)}
+
+
+def read_line_counts(path: Path | None = None) -> dict[str, FileCount]:
+    """Read the lines of code in each file that has been counted before, from LINE_COUNTS unless given a path."""
+    path = LINE_COUNTS if path is None else path
+    if not path.exists():
+        return {}
+    entries: dict[str, tuple[int, int, Digest, linecount]] = json.loads(path.read_text())
+    return {key: FileCount(*entry) for key, entry in entries.items()}
+
+
+def write_line_counts(counts: Mapping[str, FileCount], path: Path | None = None) -> None:
+    """Write the lines of code in each file, sorted so that the file diffs well, to LINE_COUNTS unless given a path."""
+    path = LINE_COUNTS if path is None else path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(counts, indent=1, sort_keys=True) + "\n")
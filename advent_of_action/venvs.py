@@ -0,0 +1,71 @@
+"""Python environments for solutions with requirements, shared by every solution with the same requirements.
+
+Run with `python -m advent_of_action.venvs`, in a solution's directory, this links `.venv` to the environment for
+the solution's requirements.txt, making it if it hasn't been made, or removes the link if there are no requirements.
+Environments are kept in CACHE_DIR, keyed by a hash of the requirements and the interpreter, and are built from a
+cache of wheels, so that requirements are only downloaded, or built, once. Environments include the interpreter's
+own packages, after their requirements, so that a solution can still use anything that was already installed.
+"""
+
+import fcntl
+import hashlib
+import shutil
+import subprocess
+import sys
+import venv
+from pathlib import Path
+from typing import Final
+
+from advent_of_action.runners import cache_dir
+
+# Where a solution's environment is linked to, which PYTHON.run puts first on the PATH.
+VENV: Final = ".venv"
+
+
+def environment_key(requirements: Path) -> str:
+    """Hash the requirements and the interpreter they would be installed for."""
+    interpreter = f"{sys.version}\0{sys.base_prefix}\0".encode()
+    return hashlib.sha256(interpreter + requirements.read_bytes()).hexdigest()[:16]
+
+
+def install(requirements: Path, environment: Path, wheels: Path) -> None:
+    """Install requirements into an environment from the wheel cache, first adding any wheels that aren't there."""
+    # The interpreter's pip installs into the environment, which needn't have pip of its own.
+    pip = [sys.executable, "-m", "pip", "--python", str(environment / "bin" / "python")]
+    offline = [*pip, "install", "-q", "--no-input", "--no-index", "--find-links", str(wheels), "-r", str(requirements)]
+    if subprocess.run(offline, stderr=subprocess.DEVNULL).returncode == 0:
+        return
+    wheel = [sys.executable, "-m", "pip", "wheel", "-q", "--no-input", "--wheel-dir", str(wheels)]
+    subprocess.run([*wheel, "--find-links", str(wheels), "-r", str(requirements)], check=True)
+    subprocess.run(offline, check=True)
+
+
+def environment(requirements: Path, root: Path) -> Path:
+    """Get the environment for some requirements, making it, unless another solution already has, if need be."""
+    key = environment_key(requirements)
+    path = root / "envs" / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Solutions with the same requirements may be set up at once, so only one of them makes the environment.
+    with (root / "envs" / f"{key}.lock").open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not (path / ".ready").exists():
+            # Whatever is there, if anything, is what's left of a failed attempt.
+            shutil.rmtree(path, ignore_errors=True)
+            venv.create(path, system_site_packages=True, symlinks=True)
+            install(requirements.resolve(), path, root / "wheels")
+            (path / ".ready").touch()
+    return path
+
+
+def main() -> None:
+    """Link the solution in the current directory to the environment for its requirements, if it has any."""
+    link = Path(VENV)
+    if link.is_symlink():
+        link.unlink()
+    requirements = Path("requirements.txt")
+    if requirements.exists():
+        link.symlink_to(environment(requirements, cache_dir()))
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
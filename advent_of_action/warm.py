@@ -0,0 +1,210 @@
+"""Warm runtimes, which start once per solution and fork to run each part, so that startup isn't timed.
+
+Run with `python -m advent_of_action.warm <script>`, in a solution's directory, this is a server that compiles the
+script once and then, for each line of JSON arguments on stdin, forks, runs the script with those arguments and
+writes a line of JSON results to stdout. It imports nothing but the standard library unless it has to compile a
+notebook or a notebook uses IPython.
+"""
+
+import builtins
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, TextIO
+
+from advent_of_action.notebook import compile_notebook, namespace, uses_ipython
+from advent_of_action.runners import Measurement, kill_group
+from advent_of_action.venvs import VENV
+
+type Runner = Callable[[], None]
+
+# The sys.path entry that we were imported from, which a solution's environment may not have.
+PACKAGE_PATH = str(Path(__file__).resolve().parent.parent)
+
+
+def cpu_seconds() -> float:
+    """Get the CPU (user plus system) time used by this process and any children it has waited for."""
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(x.ru_utime + x.ru_stime for x in usage)
+
+
+def load(script: str) -> Runner:
+    """Do whatever we can before a script is run, such as compiling it, and return a function to run it."""
+    if script.endswith(".ipynb"):
+        notebook = compile_notebook(Path(script))
+        # Each run is in a forked child, with a copy of this namespace, so start IPython now, if it's used, not in each.
+        the_namespace = namespace(Path(script), uses_ipython(notebook))
+        return lambda: exec(notebook, the_namespace)
+
+    code = compile(Path(script).read_text(), script, "exec")
+    return lambda: exec(code, {"__name__": "__main__", "__file__": script, "__builtins__": builtins})
+
+
+@contextmanager
+def captured_output() -> Generator[tuple[IO[bytes], IO[bytes]], None, None]:
+    """Capture stdout and stderr, including any written by extension modules or subprocesses, until we're done."""
+    saved = os.dup(1), os.dup(2)
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(stdout.fileno(), 1)
+        os.dup2(stderr.fileno(), 2)
+        try:
+            yield stdout, stderr
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, original in enumerate(saved, start=1):
+                os.dup2(original, fd)
+                os.close(original)
+
+
+def run_child(run: Runner, script: str, argv: list[str], results: int) -> None:
+    """Run a script, as if it were started with argv, writing its output and timings to the results pipe."""
+    with captured_output() as (stdout, stderr):
+        sys.argv = [script, *argv]
+        returncode = 0
+        start_cpu, start = cpu_seconds(), time.perf_counter_ns()
+        try:
+            run()
+        except SystemExit as e:
+            if isinstance(e.code, int) or e.code is None:
+                returncode = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        wall_ns, used_cpu = time.perf_counter_ns() - start, cpu_seconds() - start_cpu
+        sys.stdout.flush()
+        sys.stderr.flush()
+        stdout.seek(0)
+        stderr.seek(0)
+        result = {
+            "returncode": returncode,
+            "stdout": stdout.read().decode(errors="replace"),
+            "stderr": stderr.read().decode(errors="replace"),
+            "cpu_seconds": used_cpu,
+            "wall_seconds": wall_ns / 1e9,
+        }
+    with os.fdopen(results, "w") as pipe:
+        json.dump(result, pipe)
+
+
+def serve(script: str, requests: TextIO, replies: TextIO) -> None:
+    """Run a script, in a forked child, for each line of JSON arguments in requests."""
+    run = load(script)
+    print("ready", file=replies, flush=True)
+    for line in requests:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            os.close(read_fd)
+            # As in a cold run, the script's stdin is empty, rather than our requests, which are read a line at a time.
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.close(devnull)
+            run_child(run, script, json.loads(line), write_fd)
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            result = pipe.read()
+        _, status, usage = os.wait4(pid, 0)
+        reply = json.loads(result) if result else {"returncode": os.waitstatus_to_exitcode(status), "stdout": ""}
+        # ru_maxrss is in bytes on macOS but kibibytes on Linux.
+        reply["kibytes"] = usage.ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+        print(json.dumps(reply), file=replies, flush=True)
+
+
+class WarmRuntime:
+    """A server that runs a solution's script without starting an interpreter each time, restarting if it dies."""
+
+    def __init__(self, script: str, directory: Path) -> None:
+        """Start a server in the solution's directory."""
+        self.script = script
+        self.directory = directory
+        self.server: subprocess.Popen[str] | None = None
+
+    def start(self) -> subprocess.Popen[str]:
+        """Start the server, and wait until it is ready, unless it is already running.
+
+        The server runs in the solution's environment, if it has one, so that it can import its requirements, with
+        PACKAGE_PATH added to its PYTHONPATH, so that it can import us.
+        """
+        server = self.server
+        if server is None or server.poll() is not None:
+            python = self.directory / VENV / "bin" / "python"
+            args = [str(python) if python.exists() else sys.executable, "-m", "advent_of_action.warm", self.script]
+            python_path = os.pathsep.join(x for x in (PACKAGE_PATH, os.getenv("PYTHONPATH")) if x)
+            server = self.server = subprocess.Popen(
+                args,
+                cwd=self.directory,
+                env=os.environ | {"PYTHONPATH": python_path},
+                text=True,
+                start_new_session=True,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            assert server.stdout is not None
+            if server.stdout.readline() != "ready\n":
+                # For example, because the script has a syntax error, which the server will have printed.
+                self.close()
+                raise subprocess.CalledProcessError(1, " ".join(args))
+        return server
+
+    def run(self, argv: list[str], timeout: float | None = None) -> Measurement:
+        """Run the script with argv, as execute_command would, but timing the script and not the interpreter."""
+        if timeout is None:
+            timeout = float(os.environ["TIMEOUT_SECONDS"])
+        cmd_str = " ".join([self.script, *argv])
+        print("Running warm", [self.script, *argv])
+        server = self.start()
+        requests, replies = server.stdin, server.stdout
+        assert requests is not None and replies is not None
+
+        timed_out = threading.Event()
+        # The server leads the process group, which includes the script.
+        timer = threading.Timer(timeout, kill_group, args=(server.pid, timed_out))
+        timer.start()
+        try:
+            requests.write(json.dumps(argv) + "\n")
+            requests.flush()
+            reply = replies.readline()
+        except BrokenPipeError:
+            reply = ""
+        finally:
+            timer.cancel()
+
+        if timed_out.is_set():
+            self.close()
+            raise subprocess.TimeoutExpired(cmd_str, timeout)
+        if not reply:
+            self.close()
+            raise subprocess.CalledProcessError(-1, cmd_str, stderr="The warm runtime died.\n")
+        result = json.loads(reply)
+        if result["returncode"]:
+            raise subprocess.CalledProcessError(
+                result["returncode"], cmd_str, output=result["stdout"], stderr=result.get("stderr", "")
+            )
+        return Measurement(result["kibytes"], result["cpu_seconds"], result["stdout"].strip(), result["wall_seconds"])
+
+    def close(self) -> None:
+        """Stop the server, if it is running."""
+        server, self.server = self.server, None
+        if server is not None:
+            with server:
+                server.kill()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.stdin, sys.stdout)  # pragma: no cover
@@ -13,6 +13,9 @@ class ProjectSummary:
 class SourceAnalysis:
     """Just a type stub."""
 
+    code_count: int
+    is_countable: bool
+
     @staticmethod
     def from_file(filepath: Path, name: str) -> SourceAnalysis:
         """Just a type stub."""
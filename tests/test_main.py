@@ -1,15 +1,55 @@
 """Tests for the main module."""
 
+import asyncio
+import io
+import json
 import os
 import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from contextlib import nullcontext
 from pathlib import Path
-from subprocess import run
-from unittest.mock import MagicMock, call, patch
+from queue import SimpleQueue
+from typing import IO
+from unittest.mock import ANY, MagicMock, call, patch
 
-from advent_of_action import main, runners
+from advent_of_action import calibration, main, notebook, reports, runners, shards, store, venvs, warm
 from advent_of_action.runners import Commands, command
+from advent_of_action.store import Stat
+
+
+def fake_pipe(text: str) -> IO[str]:
+    """Make a pipe that has had text written to it and been closed, as a finished command's stdout would have."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, text.encode())
+    os.close(write_fd)
+    return os.fdopen(read_fd)
+
+
+def fake_shell(stdout: str = "helloo", stderr: str = "") -> tuple[MagicMock, int]:
+    """Make a finished shell, and the process ID of its command, for a mock runners.spawn to return."""
+    shell = MagicMock(pid=1234, returncode=0, stdout=fake_pipe(stdout), stderr=fake_pipe(stderr))
+    return shell, 1234
+
+
+def fake_spawn(cmd_str: str, cwd: Path | None) -> tuple[MagicMock, int]:
+    """Pretend to start a command, which prints helloo, as runners.spawn would."""
+    return fake_shell()
+
+
+def fake_wait4(kibytes: int = 1792, user: float = 0.02, system: float = 0.01) -> tuple[int, int, MagicMock]:
+    """Make the result of a mock runners.reap (i.e. of os.wait4) for a command that exited successfully."""
+    return 1234, 0, MagicMock(ru_maxrss=kibytes, ru_utime=user, ru_stime=system)
+
+
+WAIT4: tuple[int, int, MagicMock] = fake_wait4()
+
+# Whether the OS supports CPU affinity, which macOS doesn't.
+AFFINITY: bool = hasattr(os, "sched_getaffinity")
 
 
 class TestMain(unittest.TestCase):
@@ -21,194 +61,410 @@ class TestMain(unittest.TestCase):
         os.environ["GPG_PASS"] = "yourpassword"
         os.environ["TIMEOUT_SECONDS"] = "50"
 
-        # For example, if we're on macOS.
-        def new_run(command, *args, **kwargs):  # type: ignore
-            command = "gtime" + command[13:]
-            return run(command, *args, **kwargs)
-
-        if shutil.which("gtime"):
-            patch("subprocess.run", new=new_run).start()
-
-    @classmethod
-    def tearDownClass(cls) -> None:
-        """Tear down the test environment for the class."""
-        patch.stopall()
-
     def setUp(self) -> None:
         """Set up the test environment for each function."""
         # Undo anything that might have been set by failing tests.
         Path("./README.md").unlink(missing_ok=True)
         Path("./input.txt").unlink(missing_ok=True)
+        shutil.rmtree(".advent_of_action", ignore_errors=True)
         self.maxDiff = None
+        # Scoring the machine takes a while, which the tests don't need.
+        score = patch("advent_of_action.main.machine_score", autospec=True, return_value=1.0)
+        score.start()
+        self.addCleanup(score.stop)
 
-    @patch("subprocess.run", autospec=True)
-    def test_main(self, mock_run: MagicMock) -> None:
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main(self, mock_spawn: MagicMock, _: MagicMock) -> None:
         """We should run all the solutions."""
-        mock_run.return_value.stdout = "helloo"
-        mock_run.return_value.stderr = "1792,0.01,0.02"
         Path("README.md").write_text("")
         main.main()
-        common_args = {"capture_output": True, "text": True, "check": True, "shell": True}
-        setup_args = {
-            **common_args,
-            "timeout": 60.0,
-        }
-        run_args = {
-            **common_args,
-            "timeout": 50.0,
-        }
-        timings = ["/usr/bin/time", "-f", "%M,%S,%U"]
-        pip_install = [
-            call(
-                " ".join(timings + ["pip", "install", "-q", "-q", "-q", "--no-input", "-r", "requirements.txt"]),
-                **setup_args,
-            )
-        ]
-        pip_uninstall = [
-            call(
-                " ".join(
-                    timings + ["pip", "uninstall", "-q", "-q", "-q", "--no-input", "--yes", "-r", "requirements.txt"]
-                ),
-                **setup_args,
-            )
-        ]
-        python_run = [
-            call(
-                " ".join(timings + ["python", "solution.py", x]),
-                **run_args,
-            )
-            for x in ("one", "two")
-        ]
+        self.assertListEqual([], list(Path("day_99").glob("*/input.txt")))
+        phases = store.read_store()["day_99/go_iain"].phases
+        self.assertEqual({"decrypt", "setup", "one", "two", "teardown", "lines"}, set(phases))
 
-        self.assertListEqual(
-            mock_run.call_args_list,
-            [
-                call(
-                    " ".join(timings + ["dotnet", "fsi", "solution.fsx", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ]
-            + [
-                call(
-                    " ".join(timings + ["go", "build", "."]),
-                    **setup_args,
-                )
-            ]
-            + [
-                call(
-                    " ".join(timings + ["./solution", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ]
-            + [
-                call(
-                    " ".join(timings + ["cabal", "build"]),
-                    **setup_args,
-                )
-            ]
-            + [
-                call(
-                    " ".join(timings + ["$(cabal list-bin solution)", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ]
-            + [
-                call(
-                    " ".join(timings + ["ipython", "-c", "'%run solution.ipynb'", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ]
-            + [
-                call(
-                    " ".join(timings + ["ocaml", "solution.ml", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ]
-            + pip_install
-            + python_run
-            + pip_uninstall
-            + pip_install
-            + python_run
-            + pip_uninstall
-            + [
-                call(
-                    " ".join(timings + ["racket", "solution.rkt", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ]
-            + [
-                call(
-                    " ".join(timings + ["cargo", "build", "--quiet", "--release"]),
-                    **setup_args,
-                )
-            ]
-            + [
-                call(
-                    " ".join(timings + ["./target/release/solution", x]),
-                    **run_args,
-                )
-                for x in ("one", "two")
-            ],
+        def setup(cmd: list[str], directory: str) -> list[object]:
+            return [call(" ".join(cmd), Path("day_99", directory))]
+
+        def parts(cmd: list[str], directory: str) -> list[object]:
+            return [call(" ".join(cmd + [x]), Path("day_99", directory)) for x in ("one", "two")]
+
+        notebook = ["python", "-m", "advent_of_action.notebook", "solution.ipynb"]
+        venvs = ["python", "-m", "advent_of_action.venvs"]
+        python = ["PATH=.venv/bin:$PATH", "python", "solution.py"]
+
+        # Builds run ahead of, and alongside, the timed parts so only the order within a solution is fixed.
+        calls_by_directory: dict[Path, list[object]] = {}
+        for the_call in mock_spawn.call_args_list:
+            calls_by_directory.setdefault(the_call.args[1], []).append(the_call)
+
+        self.assertDictEqual(
+            calls_by_directory,
+            {
+                Path("day_99/fsharp_iain"): parts(["dotnet", "fsi", "solution.fsx"], "fsharp_iain"),
+                Path("day_99/go_iain"): setup(["go", "build", "."], "go_iain") + parts(["./solution"], "go_iain"),
+                Path("day_99/haskell_iain"): setup(["cabal", "build"], "haskell_iain")
+                + parts(["$(cabal list-bin solution)"], "haskell_iain"),
+                Path("day_99/jupyter_iain"): setup(notebook, "jupyter_iain") + parts(notebook, "jupyter_iain"),
+                Path("day_99/ocaml_iain"): parts(["ocaml", "solution.ml"], "ocaml_iain"),
+                Path("day_99/python_iain"): setup(venvs, "python_iain")
+                + parts(python, "python_iain")
+                + setup(["rm", "-f", ".venv"], "python_iain"),
+                Path("day_99/python_zain"): setup(venvs, "python_zain")
+                + parts(python, "python_zain")
+                + setup(["rm", "-f", ".venv"], "python_zain"),
+                Path("day_99/racket_iain"): parts(["racket", "solution.rkt"], "racket_iain"),
+                Path("day_99/rust_iain"): setup(["cargo", "build", "--quiet", "--release"], "rust_iain")
+                + parts(["./target/release/solution"], "rust_iain"),
+            },
         )
 
-    @patch("subprocess.run", autospec=True)
-    def test_main_two(self, mock_run: MagicMock) -> None:
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_two(self, mock_spawn: MagicMock, _: MagicMock) -> None:
         """We shouldn't re-run a solution that we have stats for."""
-        mock_run.return_value.stdout = "helloo"
-        mock_run.return_value.stderr = "1792,0.01,0.02"
         shutil.copy(Path("README_TEMPLATE_3.md"), Path("README.md"))
         main.main()
-        timings = ["/usr/bin/time", "-f", "%M,%S,%U"]
-        self.assertListEqual(
-            mock_run.call_args_list,
-            [
-                call(
-                    " ".join(timings + x),
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                    shell=True,
-                    timeout=50.0,
-                )
-                for x in [["dotnet", "fsi", "solution.fsx", x] for x in ("one", "two")]
-            ]
-            + [
-                call(
-                    " ".join(timings + x),
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                    shell=True,
-                    timeout=60,
-                )
-                for x in [["cargo", "build", "--quiet", "--release"]]
-            ]
-            + [
-                call(
-                    " ".join(timings + x),
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                    shell=True,
-                    timeout=50.0,
-                )
-                for x in [["./target/release/solution", x] for x in ("one", "two")]
-            ],
+        self.assertCountEqual(
+            mock_spawn.call_args_list,
+            [call(f"dotnet fsi solution.fsx {x}", Path("day_99/fsharp_iain")) for x in ("one", "two")]
+            + [call("cargo build --quiet --release", Path("day_99/rust_iain"))]
+            + [call(f"./target/release/solution {x}", Path("day_99/rust_iain")) for x in ("one", "two")],
         )
 
-    @patch("subprocess.run", autospec=True)
-    def test_measure_one(self, mock_run: MagicMock) -> None:
-        """Check that we can measure the execution time of a solution."""
-        mock_run.return_value = MagicMock(stdout="answer\n", stderr="1792,0.02,0.01")
+    @patch.dict(os.environ, {"JOBS": "4", "BUILD_JOBS": "2", "EXCLUSIVE_TIMING": "true"})
+    @patch("advent_of_action.main.available_cpus", return_value=[0, 0, 0])
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_parallel(self, mock_spawn: MagicMock, _: MagicMock, mock_cpus: MagicMock) -> None:
+        """We should get the same results, in the same order, from several workers."""
+        Path("README.md").write_text("")
+        with patch("advent_of_action.main.ThreadPoolExecutor", wraps=main.ThreadPoolExecutor) as mock_executor:
+            main.main()
+
+        mock_cpus.assert_called_once_with(False)
+        self.assertListEqual([2, 2], [x.kwargs["max_workers"] for x in mock_executor.call_args_list])
+        self.assertEqual(26, mock_spawn.call_count)
+        table = Path("README.md").read_text()
+        self.assertLess(table.index("| fsharp | iain |"), table.index("| rust | iain |"))
+
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_sharded(self, mock_spawn: MagicMock, _: MagicMock) -> None:
+        """Each shard should measure its share of the solutions, which are merged into the store and README after."""
+        Path("README.md").write_text("")
+        deleted = "day_99/python_iain/deleted.py"
+        store.write_line_counts({deleted: store.FileCount(1, 1, "abc", 1)})
+        spawned = []
+        for index in (1, 2, 2):
+            mock_spawn.reset_mock()
+            with patch.dict(os.environ, {"SHARD": f"{index}/2"}):
+                main.main()
+            spawned.append(mock_spawn.call_count)
+        self.assertEqual("", Path("README.md").read_text())
+        self.assertFalse(store.STORE.exists())
+        self.assertEqual(26, sum(spawned[:2]))
+        self.assertEqual(spawned[1], spawned[2])
+        self.assertEqual(["1-of-2", "2-of-2"], sorted(x.name for x in shards.SHARDS.iterdir()))
+        one, two = (store.read_line_counts(shards.SHARDS / x / "lines.json") for x in ("1-of-2", "2-of-2"))
+        self.assertTrue(one and two)
+        self.assertFalse({str(Path(x).parent) for x in one} & {str(Path(x).parent) for x in two})
+
+        with patch.dict(os.environ, {"MERGE_SHARDS": "true"}):
+            (shards.SHARDS / "1-of-3").mkdir()
+            with self.assertRaisesRegex(SystemExit, "split 2 different ways"):
+                main.main()
+            (shards.SHARDS / "1-of-3").rmdir()
+            main.main()
+        self.assertFalse(shards.SHARDS.exists())
+        self.assertEqual(9, len(store.read_store()))
+        self.assertEqual(9, len(store.STORE.read_text().splitlines()))
+        self.assertEqual(9, len(reports.readme_results(Path("README.md").read_text())))
+        self.assertDictEqual(one | two, store.read_line_counts())
+        self.assertNotIn(deleted, store.read_line_counts())
+
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_filtered(self, mock_spawn: MagicMock, _: MagicMock) -> None:
+        """We should only run the solutions we're asked to and, if forced to, run them even if they haven't changed."""
+        Path("README.md").write_text("")
+        main.main(days={"99"}, languages={"python"}, people={"iain", "zain"})
+        runs = {("99", "python", "iain"), ("99", "python", "zain")}
+        self.assertSetEqual(runs, {record.run for record in store.read_store().values()})
+        main.main(days={"01"})
+        self.assertSetEqual(runs, {record.run for record in store.read_store().values()})
+
+        mock_spawn.reset_mock()
+        main.main(languages={"python"}, people={"iain"})
+        mock_spawn.assert_not_called()
+        main.main(languages={"python"}, people={"iain"}, force=True)
+        mock_spawn.assert_called()
+        self.assertEqual(3, len(store.STORE.read_text().splitlines()))
+
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_plan(self, mock_spawn: MagicMock, _: MagicMock) -> None:
+        """A plan should list what would be run, with estimates from what was recorded, without running anything."""
+        Path("README.md").write_text("")
+        main.main(languages={"python"}, people={"iain"})
+        mock_spawn.reset_mock()
+        with patch("builtins.print", autospec=True) as mock_print:
+            main.main(languages={"python"}, force=True, plan=True)
+        mock_spawn.assert_not_called()
+        report = mock_print.call_args.args[0]
+        self.assertRegex(report, r"\| 99 \| python \| iain \| 20\d\d-[^|]+ \| \d+\.\d\d \|")
+        self.assertIn("| 99 | python | zain | never |  |", report)
+        self.assertIn(", plus however long the 1 without an estimate take.", report)
 
+    def test_select_solutions(self) -> None:
+        """We should choose the solutions that need measuring, by day, without measuring them."""
+        stored: dict[str, store.Record] = {}
+        added: list[store.Record] = []
+        selected = main.select_solutions(stored, added, languages={"python", "rust"})
+        self.assertListEqual([Path("day_99")], list(selected))
+        runs = [the_run for the_run, _, _ in selected[Path("day_99")]]
+        self.assertListEqual([("99", "python", "iain"), ("99", "python", "zain"), ("99", "rust", "iain")], runs)
+
+        # Stored with the same digest and settings, or from the README before there was a store.
+        (python_iain, iain_dir, digest), (python_zain, zain_dir, _), _ = selected[Path("day_99")]
+        stats = (Stat("1.00", "1.0", ""), Stat("1.00", "1.0", ""), 3)
+        settings = main.measurement_settings("python")
+        stored[iain_dir.as_posix()] = store.Record(iain_dir.as_posix(), python_iain, digest, stats, settings=settings)
+        stored[zain_dir.as_posix()] = store.Record(zain_dir.as_posix(), python_zain, "", stats)
+        selected = main.select_solutions(stored, added, languages={"python"})
+        self.assertDictEqual({}, selected)
+        self.assertListEqual([stored[zain_dir.as_posix()]], added)
+        self.assertTrue(added[0].digest)
+        self.assertEqual(settings, added[0].settings)
+
+        # Measured in a warm runtime, so its times don't include starting up, which they would now.
+        stored[iain_dir.as_posix()] = stored[iain_dir.as_posix()]._replace(settings=settings | {"warm_runtime": "True"})
+        selected = main.select_solutions(stored, added, languages={"python"})
+        self.assertListEqual([python_iain], [the_run for the_run, _, _ in selected[Path("day_99")]])
+
+        selected = main.select_solutions(stored, added, languages={"python"}, force=True)
+        self.assertEqual(2, len(selected[Path("day_99")]))
+        selected = main.select_solutions(stored, added, languages={"python", "rust"}, force=True, the_shard=(2, 2))
+        self.assertListEqual([python_zain], [the_run for the_run, _, _ in selected[Path("day_99")]])
+
+    def test_shard_directories(self) -> None:
+        """We should only merge shards if there are all N of them, and there's nothing else in SHARDS."""
+        with self.assertRaisesRegex(SystemExit, "There are no shards"):
+            shards.shard_directories()
+        shards.SHARDS.mkdir(parents=True)
+        with self.assertRaisesRegex(SystemExit, "There are no shards"):
+            shards.shard_directories()
+        for name in ("3-of-3", "1-of-3"):
+            (shards.SHARDS / name).mkdir()
+        with self.assertRaisesRegex(SystemExit, r"Shard\(s\) 2 of 3 are missing"):
+            shards.shard_directories()
+        (shards.SHARDS / "2-of-3").mkdir()
+        self.assertListEqual(["1-of-3", "2-of-3", "3-of-3"], [x.name for x in shards.shard_directories()])
+        (shards.SHARDS / "backup").mkdir()
+        with self.assertRaisesRegex(SystemExit, "isn't a shard"):
+            shards.shard_directories()
+
+    def test_estimate(self) -> None:
+        """Estimates should come from the time the last measurement took or, if it wasn't recorded, the parts'."""
+        run = ("01", "python", "iain")
+        record = store.Record("day_01/python_iain", run, "", (Stat("1.50", "1.0", ""), Stat("", "", "Timeout"), 3))
+        with patch.dict(os.environ, {"TIMEOUT_SECONDS": "10"}):
+            self.assertEqual(11.5, shards.estimate(record))
+            report = shards.plan_report([(run, record)])
+        self.assertIn("| 01 | python | iain | before the store | 11.50 |", report)
+        self.assertIn("About 11.50 seconds in all.", report)
+        self.assertEqual(2.0, shards.estimate(record._replace(phases={"setup": 1.5, "one": 0.5})))
+        self.assertIsNone(shards.estimate(record._replace(stats=(Stat("", "", "Error (1)"), Stat("", "", ""), 3))))
+        self.assertIsNone(shards.estimate(None))
+
+    @patch("advent_of_action.main.main", autospec=True)
+    def test_cli(self, mock_main: MagicMock) -> None:
+        """Command-line filters should be passed to main, and options should override their environment variables."""
+        with patch.dict(os.environ, {}):
+            main.cli(["--day", "1", "--day", "25", "--language", "python", "--person", "iain", "--force", "--plan"])
+            main.cli(["--jobs", "4", "--shard", "1/2", "--merge-shards"])
+            self.assertEqual(
+                ("4", "1/2", "true"), (os.environ["JOBS"], os.environ["SHARD"], os.environ["MERGE_SHARDS"])
+            )
+        mock_main.assert_has_calls(
+            [call({"01", "25"}, {"python"}, {"iain"}, True, True), call(set(), set(), set(), False, False)]
+        )
+        with self.assertRaises(SystemExit), patch("sys.stderr", new_callable=io.StringIO):
+            main.cli(["--language", "cobol"])
+
+    def test_shard(self) -> None:
+        """A shard should be given as i/N."""
+        with patch.dict(os.environ, {"SHARD": ""}):
+            self.assertIsNone(shards.shard())
+        with patch.dict(os.environ, {"SHARD": "2/3"}):
+            self.assertEqual((2, 3), shards.shard())
+        for value in ("0/3", "4/3", "a/3", "3"):
+            with patch.dict(os.environ, {"SHARD": value}), self.assertRaises(ValueError):
+                shards.shard()
+
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_cached(self, mock_spawn: MagicMock, _: MagicMock) -> None:
+        """We should only re-run solutions that have changed since they were last measured."""
+        Path("README.md").write_text("")
+        main.main()
+        first_readme = Path("README.md").read_text()
+
+        # Nothing has changed, so the cached stats should be used, even for rows missing from the README.
+        mock_spawn.reset_mock()
+        Path("README.md").write_text("")
+        main.main()
+        mock_spawn.assert_not_called()
+        self.assertEqual(first_readme, Path("README.md").read_text())
+
+        # Everything has changed, so everything should be re-run.
+        with patch("advent_of_action.main.solution_digest", return_value="changed"):
+            main.main()
+        self.assertEqual(26, mock_spawn.call_count)
+        self.assertEqual({"changed"}, {record.digest for record in store.read_store().values()})
+
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True, side_effect=fake_spawn)
+    def test_main_base_ref(self, mock_spawn: MagicMock, _: MagicMock) -> None:
+        """With a base ref, we should only check solutions that have changed since it."""
+        Path("README.md").write_text("")
+        main.main()
+
+        mock_spawn.reset_mock()
+        with (
+            patch.dict(os.environ, {"BASE_REF": "main"}),
+            patch("advent_of_action.main.solution_digest", return_value="changed"),
+            patch("advent_of_action.main.changed_since", return_value={Path("day_99/rust_iain")}) as mock_changed,
+        ):
+            main.main()
+        mock_changed.assert_called_once_with("main")
+        self.assertCountEqual(
+            [call("cargo build --quiet --release", Path("day_99/rust_iain"))]
+            + [call(f"./target/release/solution {x}", Path("day_99/rust_iain")) for x in ("one", "two")],
+            mock_spawn.call_args_list,
+        )
+
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    def test_build(self, mock_execute: MagicMock) -> None:
+        """Check that we run the setup commands, with the setup timeout, in the solution directory."""
+        actual = main.build(Commands(["make"], [], []), Path("day_99/who"))
+        self.assertEqual(Stat("", "", "Done"), actual)
+        mock_execute.assert_called_once_with(["make"], timeout=60.0, cwd=Path("day_99/who"))
+
+    @patch.dict(os.environ, {"WARMUP_RUNS": "1", "REPETITIONS": "3", "MAX_REPETITIONS": "5"})
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    def test_measure_repeatedly(self, mock_execute: MagicMock) -> None:
+        """We should discard warmup runs and repeat until the timings are precise enough."""
+        mock_execute.side_effect = [
+            runners.Measurement(2048, seconds, "answer", seconds) for seconds in (9.0, 1.0, 1.5, 2.0, 1.0, 1.2, 9.0)
+        ]
+
+        actual = main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+        samples = tuple(store.Sample(x, x, 2048) for x in (1.0, 1.5, 2.0, 1.0, 1.2))
+        self.assertEqual(Stat("1.20", "2.0", "", "1.00", "0.42", "5", "1.20", "1.20", "1.00", samples=samples), actual)
+        self.assertEqual(6, mock_execute.call_count)
+
+        # Consistent timings should stop after the minimum number of repetitions.
+        mock_execute.side_effect = None
+        mock_execute.reset_mock()
+        mock_execute.return_value = runners.Measurement(1024, 1.0, "answer", 1.0)
+        actual = main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+        samples = (store.Sample(1.0, 1.0, 1024),) * 3
+        self.assertEqual(Stat("1.00", "1.0", "", "1.00", "0.00", "3", "1.00", "1.00", "1.00", samples=samples), actual)
+        self.assertEqual(4, mock_execute.call_count)
+
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    def test_ranking_metric(self, mock_execute: MagicMock) -> None:
+        """We should rank by CPU or wall-clock time, as asked, but record both."""
+        # A solution using four cores at once.
+        mock_execute.return_value = runners.Measurement(1024, 4.0, "answer", 1.0)
+        expected = ("1.0", "", "", "", "", "4.00", "1.00", "4.00")
+        samples = (store.Sample(4.0, 1.0, 1024),)
+
+        actual = main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+        self.assertEqual(Stat("4.00", *expected, samples=samples), actual)
+
+        with patch.dict(os.environ, {"RANKING_METRIC": "wall"}):
+            actual = main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+        self.assertEqual(Stat("1.00", *expected, samples=samples), actual)
+
+        with patch.dict(os.environ, {"RANKING_METRIC": "user"}), self.assertRaises(ValueError):
+            main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    @patch("builtins.print", autospec=True)
+    def test_measure_sandboxed(self, mock_print: MagicMock, mock_execute: MagicMock) -> None:
+        """We should say if a part was throttled or ran out of memory in its sandbox."""
+        mock_execute.return_value = runners.Measurement(1024, 1.0, "answer", 2.0, throttled=True)
+        actual = main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+        self.assertEqual("Throttled", actual.notes)
+        self.assertEqual("1.00", actual.seconds)
+
+        mock_execute.side_effect = runners.OutOfMemory(-9, "./solution one", "", "Killed\n")
+        actual = main.measure_part(runners.Part.ONE, "answer", ["./solution"])
+        self.assertEqual(Stat("", "", "OOM"), actual)
+        mock_print.assert_called_with("Command ran out of memory")
+
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    def test_measure_startup(self, mock_execute: MagicMock) -> None:
+        """We should time how long a runtime takes to do nothing, if the language has a runtime."""
+        mock_execute.return_value = runners.Measurement(1024, 0.25, "", 0.5)
+        self.assertEqual("0.25", main.measure_startup(runners.PYTHON, Path("day_99/python_iain")))
+        mock_execute.assert_called_once_with(
+            ["PATH=.venv/bin:$PATH", "python", "-c", "pass"], timeout=60.0, cwd=Path("day_99/python_iain")
+        )
+
+        with patch.dict(os.environ, {"RANKING_METRIC": "wall"}):
+            self.assertEqual("0.50", main.measure_startup(runners.PYTHON))
+        self.assertEqual("", main.measure_startup(runners.RUST))
+        mock_execute.side_effect = subprocess.CalledProcessError(127, "python -c pass")
+        self.assertEqual("", main.measure_startup(runners.PYTHON))
+
+    @patch.dict(os.environ, {"WARM_RUNTIMES": "true"})
+    @patch("advent_of_action.main.measure_startup_async", autospec=True, return_value="0.04")
+    @patch("advent_of_action.main.WarmRuntime", autospec=True)
+    def test_measure_warm(self, mock_runtime: MagicMock, _: MagicMock) -> None:
+        """Parts should be run in a warm runtime, if asked for, with the startup time alongside."""
+        mock_runtime.return_value.run.side_effect = [
+            runners.Measurement(1024, 0.5, "one", 0.5),
+            runners.Measurement(1024, 0.5, "wrong", 0.5),
+        ]
+        commands = Commands([], ["python", "solution.py", "{part}"], [], warm="solution.py")
+        one, two = main.measure_execution_time(("one", "two"), commands, Path("day_99/python_iain"))
+        samples = (store.Sample(0.5, 0.5, 1024),)
+        self.assertEqual(Stat("0.50", "1.0", "", "", "", "", "0.50", "0.50", "1.00", "0.04", samples), one)
+        self.assertEqual(Stat("", "", "Different answer", samples=samples), two)
+        mock_runtime.assert_called_once_with("solution.py", Path("day_99/python_iain"))
+        mock_runtime.return_value.run.assert_has_calls([call(["one"]), call(["two"])])
+        mock_runtime.return_value.close.assert_called_once_with()
+
+    def test_sandbox(self) -> None:
+        """Timed parts should only be sandboxed if asked for."""
+        with patch.dict(os.environ, {"CGROUP_SANDBOX": "false"}):
+            self.assertIsNone(main.sandbox())
+        with patch.dict(os.environ, {"CGROUP_SANDBOX": "true", "MEMORY_LIMIT_MIB": "", "CPU_LIMIT": ""}):
+            self.assertEqual(runners.Sandbox(Path("/sys/fs/cgroup/advent_of_action")), main.sandbox())
+        with patch.dict(
+            os.environ,
+            {"CGROUP_SANDBOX": "True", "CGROUP_ROOT": "/cgroup", "MEMORY_LIMIT_MIB": "512", "CPU_LIMIT": "1.5"},
+        ):
+            self.assertEqual(runners.Sandbox(Path("/cgroup"), 512, 1.5), main.sandbox())
+
+    def test_precise_enough(self) -> None:
+        """A single sample can't tell us how precise it is."""
+        self.assertFalse(main.precise_enough([1.0], 0.5))
+        self.assertTrue(main.precise_enough([1.0, 1.01, 0.99], 0.05))
+        self.assertFalse(main.precise_enough([1.0, 2.0, 0.5], 0.05))
+
+    @patch("time.perf_counter_ns", autospec=True, side_effect=[0, 20_000_000, 10_000_000, 0, 20_000_000, 10_000_000])
+    @patch("advent_of_action.runners.reap", autospec=True, return_value=WAIT4)
+    @patch("advent_of_action.runners.spawn", autospec=True)
+    def test_measure_one(self, mock_spawn: MagicMock, _: MagicMock, __: MagicMock) -> None:
+        """Check that we can measure the execution time of a solution."""
+        mock_spawn.side_effect = [fake_shell("answer\n"), fake_shell("answer\n")]
         actual = main.measure_execution_time(("answer", "answer"), Commands([], [], []))
-        expected = (("0.03", "1.8", ""),) * 2
+        samples = (store.Sample(0.02 + 0.01, 0.02, 1792, 0.01),)
+        expected = (Stat("0.03", "1.8", "", "", "", "", "0.03", "0.02", "1.50", samples=samples),) * 2
         self.assertEqual(
             expected,
             actual,
@@ -219,18 +475,14 @@ class TestMain(unittest.TestCase):
         actual = main.measure_execution_time(
             ("answer", "answer"), Commands(["echo", "different"], ["echo", "different"], ["echo", "different"])
         )
-        expected = ("", "", "Different answer"), ("", "", "Different answer")
-        self.assertEqual(
-            expected,
-            actual,
-        )
+        self.assertEqual(("Different answer", "Different answer"), tuple(x.notes for x in actual))
 
     @patch("builtins.print", autospec=True)
     def test_measure_three(self, mock_print: MagicMock) -> None:
         """Check that we can handle a non-zero exit code."""
         exit_1: command = ["bash", "-c", "'exit 1'"]
         actual = main.measure_execution_time(("", ""), Commands(exit_1, exit_1, exit_1))
-        expected = ("", "", "Error (1)"), ("", "", "Error (1)")
+        expected = Stat("", "", "Error (1)"), Stat("", "", "Error (1)")
         self.assertTupleEqual(
             expected,
             actual,
@@ -242,44 +494,112 @@ class TestMain(unittest.TestCase):
     def test_measure_four(self, mock_print: MagicMock) -> None:
         """Check that we can handle a partially wrong answer."""
         actual = main.measure_execution_time(("one_", "two"), Commands(["sleep", "0"], ["echo {part}"], ["sleep", "0"]))
-        expected = ("", "", "Different answer")
-        self.assertTupleEqual(
-            expected,
-            actual[0],
-        )
+        self.assertEqual("Different answer", actual[0].notes)
+        self.assertEqual("", actual[0].seconds)
         mock_print.assert_any_call("Incorrect answer for part one: one")
 
-    @patch("subprocess.run", autospec=True)
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
     @patch("builtins.print", autospec=True)
-    def test_measure_five(self, mock_print: MagicMock, mock_run: MagicMock) -> None:
+    def test_measure_five(self, mock_print: MagicMock, mock_execute: MagicMock) -> None:
         """Check that we can handle a timeout."""
-        mock_run.side_effect = subprocess.TimeoutExpired("cmd", 6)
+        mock_execute.side_effect = subprocess.TimeoutExpired("cmd", 6)
 
         actual = main.measure_execution_time(("", ""), runners.Commands([], [], []))
 
-        expected = ("", "", "Timeout"), ("", "", "Timeout")
+        expected = Stat("", "", "Timeout"), Stat("", "", "Timeout")
         self.assertTupleEqual(
             expected,
             actual,
         )
         mock_print.assert_called_with("Command timed out after 6 seconds")
 
-    @patch("subprocess.run", autospec=True)
-    def test_execute_command(self, mock_run: MagicMock) -> None:
-        """Executing a command should return the memory usage, time and stdout."""
-        mock_run.return_value.stdout = "hello\n"
-        mock_run.return_value.stderr = "someoutput\n1792,0.01,0.02"
-        actual = runners.execute_command(
-            [],
-        )
-        self.assertTupleEqual(
-            actual,
-            (
-                1792,
-                0.01 + 0.02,
-                "hello",
-            ),
-        )
+    def test_growth_exponent(self) -> None:
+        """We should fit how a part grows with its input, given at least two sizes."""
+        self.assertEqual("2.00", main.growth_exponent([10, 20, 40], [1.0, 4.0, 16.0]))
+        self.assertEqual("0.50", main.growth_exponent([100, 400, 900], [10, 20, 30]))
+        self.assertEqual("", main.growth_exponent([10, 20], [1.0, 0.0]))
+        self.assertEqual("", main.growth_exponent([], []))
+
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    def test_measure_growth(self, mock_execute: MagicMock) -> None:
+        """Parts with the right answer should be run on each scaled input, smallest first, to see how they grow."""
+
+        def quadratic(cmd: list[str], part: runners.Part, cwd: Path, **_: object) -> runners.Measurement:
+            size = (cwd / "input.txt").stat().st_size
+            if size > 400:
+                raise subprocess.TimeoutExpired(cmd, 10)
+            return runners.Measurement(size * 10, size * size / 1e6, str(part), 0.0)
+
+        mock_execute.side_effect = quadratic
+        with tempfile.TemporaryDirectory() as tmp:
+            scaled = []
+            for size in (800, 200, 100, 400):
+                scaled.append(Path(tmp, f"{size}.txt"))
+                scaled[-1].write_text("x" * size)
+            solution_dir = Path(tmp, "python_iain")
+            solution_dir.mkdir()
+            (solution_dir / "input.txt").write_text("x")
+            one, two = main.measure_execution_time(
+                ("one", "wrong"), Commands([], ["./solution"], []), solution_dir, None, scaled
+            )
+
+        self.assertEqual(("2.00", "1.00"), (one.time_growth, one.memory_growth))
+        self.assertEqual(("", ""), (two.time_growth, two.memory_growth))
+        # The two parts, then part one on the three inputs it finishes and the one it doesn't.
+        self.assertEqual(6, mock_execute.call_count)
+
+    @patch("advent_of_action.main.perf_available", autospec=True, return_value=True)
+    @patch("advent_of_action.main.execute_command_async", autospec=True)
+    def test_measure_counters(self, mock_execute: MagicMock, mock_available: MagicMock) -> None:
+        """Parts with the right answer should be run once more under perf stat, if asked for, to count events."""
+
+        def perf_stat(cmd: command, **_: object) -> runners.Measurement:
+            if cmd[0] == "perf":
+                Path(cmd[4]).write_text("3000,,instructions:u,1,100.00,,\n1000,,cycles:u,1,100.00,,\n")
+            return runners.Measurement(1024, 0.5, "one", 0.5)
+
+        mock_execute.side_effect = perf_stat
+        with patch.dict(os.environ, {"PERF_COUNTERS": "true"}):
+            one, two = main.measure_execution_time(("one", "two"), Commands([], ["./solution", "{part}"], []))
+        self.assertEqual({"instructions": 3000, "cycles": 1000, "ipc": 3.0}, one.counters)
+        self.assertEqual({}, two.counters)
+        self.assertEqual(3, mock_execute.call_count)
+
+        mock_execute.side_effect = subprocess.CalledProcessError(1, "perf stat ./solution one")
+        self.assertEqual({}, asyncio.run(main.measure_counters(runners.Part.ONE, ["./solution", "{part}"])))
+        mock_available.return_value = False
+        self.assertEqual({}, asyncio.run(main.measure_counters(runners.Part.ONE, ["./solution", "{part}"])))
+        self.assertEqual(4, mock_execute.call_count)
+
+    def test_measure_concurrently(self) -> None:
+        """Solutions can be measured as tasks in one event loop, taking turns to be timed."""
+
+        async def measure_both() -> list[tuple[Stat, Stat]]:
+            timing_lock = asyncio.Lock()
+            comm = Commands([], ["echo {part}"], [])
+            return list(
+                await asyncio.gather(
+                    *(main.measure_execution_time_async(("one", "two"), comm, Path("."), timing_lock) for _ in range(2))
+                )
+            )
+
+        for one, two in asyncio.run(measure_both()):
+            self.assertTrue(one.seconds and two.seconds)
+            self.assertEqual(("", ""), (one.notes, two.notes))
+
+    @patch("advent_of_action.runners.reap", autospec=True)
+    @patch("advent_of_action.runners.spawn", autospec=True)
+    def test_execute_command(self, mock_spawn: MagicMock, mock_reap: MagicMock) -> None:
+        """Executing a command should return the memory usage, times and stdout."""
+        mock_spawn.return_value = fake_shell("hello\n", "someoutput\n")
+        mock_reap.return_value = fake_wait4(1792, 0.01, 0.02)
+        actual = runners.execute_command(["./solution", "{part}"], part=runners.Part.ONE, cwd=Path("day_99"))
+        self.assertEqual(1792, actual.kibytes)
+        self.assertAlmostEqual(0.01 + 0.02, actual.cpu_seconds)
+        self.assertEqual("hello", actual.stdout)
+        self.assertGreater(actual.wall_seconds, 0)
+        mock_spawn.assert_called_once_with("./solution one", Path("day_99"))
+        mock_reap.assert_called_once_with(1234)
 
     def test_write_results(self) -> None:
         """Check we can write to a README with some existing stats."""
@@ -288,12 +608,13 @@ class TestMain(unittest.TestCase):
         expected_readme_txt = Path("EXPECTED_README_2.md").read_text()
 
         run = ("01", "python", "iain")
-        stat = ("0.01", "17.0", "")
+        stat = Stat("0.01", "17.0", "")
+        results = {**reports.readme_results(readme.read_text()), run: (stat, stat, 3)}
 
-        main.write_results({run: (stat, stat, 3)})
+        reports.write_results(results)
         self.assertEqual(expected_readme_txt, readme.read_text())
 
-        main.write_results({run: (stat, stat, 3)})
+        reports.write_results(results)
         self.assertEqual(expected_readme_txt, readme.read_text())
 
     def test_write_results_two(self) -> None:
@@ -303,22 +624,23 @@ class TestMain(unittest.TestCase):
         expected_readme_txt = Path("EXPECTED_README_3.md").read_text()
 
         run = ("01", "python", "iain")
-        stat = ("0.01", "1792", "")
+        stat = Stat("0.01", "1792", "")
 
-        main.write_results({run: (stat, stat, 8)})
+        reports.write_results({run: (stat, stat, 8)})
         self.assertEqual(expected_readme_txt, readme.read_text())
 
-        main.write_results({run: (stat, stat, 8)})
+        reports.write_results({run: (stat, stat, 8)})
         self.assertEqual(expected_readme_txt, readme.read_text())
 
     def test_get_answers(self) -> None:
         """Test that we can get the answers from an encrypted file."""
         actual = main.get_answers(Path("day_99/"))
         self.assertEqual(("answer", "answer2"), actual)
+        self.assertFalse(Path("answers.txt").exists())
 
     def test_from_table(self) -> None:
         """Test that we can convert a table to a dictionary."""
-        actual = main.from_table(
+        actual = reports.from_table(
             "\n"
             + "\n"
             + "## Stats\n"
@@ -330,13 +652,37 @@ class TestMain(unittest.TestCase):
             + "\n"
             + "\n"
         )
-        expected = {("01", "python", "iain"): (("0.01", "1792", ""), ("0.01", "1792", ""), 7)}
+        expected = {("01", "python", "iain"): (Stat("0.01", "1792", ""), Stat("0.01", "1792", ""), 7)}
         self.assertDictEqual(expected, actual)
 
+    def test_table_round_trip(self) -> None:
+        """Optional columns should only be in the table if some solution has them."""
+        plain = {("01", "python", "iain"): (Stat("0.01", "1.0", ""), Stat("", "", "Timeout"), 7)}
+        self.assertNotIn("stdev", reports.to_table(plain))
+        self.assertDictEqual(plain, reports.from_table(reports.to_table(plain)))
+
+        repeated = {
+            **plain,
+            ("01", "rust", "iain"): (Stat("0.01", "1.0", "", "0.00", "0.01", "5"), Stat("0.02", "1.0", ""), 9),
+        }
+        table = reports.to_table(repeated)
+        self.assertIn("| time (s) | mem (MiB) | min (s) | stdev (s) | runs | notes |", table)
+
+        self.assertIn("| 01 | rust | iain | 9 | one | 0.01 | 1.0 | 0.00 | 0.01 | 5 |  |", table)
+        self.assertIn("| 01 | python | iain | 7 | two |  |  |  |  |  | Timeout |", table)
+        self.assertDictEqual(repeated, reports.from_table(table))
+
+        parallel = Stat("0.04", "1.0", "", cpu_seconds="0.04", wall_seconds="0.01", parallelism="4.00")
+        timed = {("01", "rust", "iain"): (parallel, parallel, 9)}
+        table = reports.to_table(timed)
+        self.assertIn("| time (s) | mem (MiB) | cpu (s) | wall (s) | parallelism | notes |", table)
+        self.assertIn("| 01 | rust | iain | 9 | two | 0.04 | 1.0 | 0.04 | 0.01 | 4.00 |  |", table)
+        self.assertDictEqual(timed, reports.from_table(table))
+
     def test_from_table_raises(self) -> None:
         """We expect an error if the part isn't 'one' or 'two'."""
         with self.assertRaises(ValueError):
-            main.from_table(
+            reports.from_table(
                 "\n"
                 + "\n"
                 + "## Stats\n"
@@ -362,10 +708,114 @@ class TestExpectsGPG(unittest.TestCase):
         with self.assertRaises(ValueError):
             main.get_answers(Path("day_99/"))
 
-    def test_make_input_raises(self) -> None:
-        """Test that make_input_file raises an exception if GPG_PASS is missing."""
+    def test_decrypt_raises(self) -> None:
+        """Test that decrypt raises an exception if GPG_PASS is missing."""
         with self.assertRaises(ValueError):
-            main.make_input_file()
+            main.decrypt(Path("day_99/input.gpg"))
+
+
+@patch.dict(os.environ, {"GPG_PASS": "yourpassword"})
+class TestInput(unittest.TestCase):
+    """Test the functions that hand the decrypted input to solutions."""
+
+    def test_decrypted_input(self) -> None:
+        """The input should be decrypted to a read-only file that is deleted afterwards."""
+        with self.assertRaises(RuntimeError), main.decrypted_input(Path("day_99")) as input_file:
+            self.assertEqual("ANSWER\nANSWER2\n", input_file.read_text())
+            self.assertEqual(0o444, input_file.stat().st_mode & 0o777)
+            raise RuntimeError("A solution went wrong.")
+        self.assertFalse(input_file.exists())
+
+    def test_scaled_inputs(self) -> None:
+        """A day's scaled inputs should be generated, decrypted or used as they are, if SCALING is true."""
+        with tempfile.TemporaryDirectory() as tmp:
+            scaling = Path(tmp, "day_01", "scaling")
+            scaling.mkdir(parents=True)
+            with main.scaled_inputs(scaling.parent) as actual:
+                self.assertEqual((), actual)
+
+            shutil.copy(Path("day_99/input.gpg"), scaling / "real.gpg")
+            (scaling / "tiny.txt").write_text("1\n")
+            (scaling / "generate").write_text('#!/bin/sh\nhead -c "$1" /dev/zero\n')
+            (scaling / "generate").chmod(0o755)
+            with (
+                patch.dict(os.environ, {"SCALING": "true", "SCALING_SIZES": "10, 20"}),
+                main.scaled_inputs(scaling.parent) as actual,
+            ):
+                self.assertEqual([10, 20, 15, 2], [x.stat().st_size for x in actual])
+                self.assertEqual("ANSWER\nANSWER2\n", actual[2].read_text())
+            self.assertFalse(actual[0].exists())
+            self.assertTrue(actual[3].exists())
+
+            # A generator that fails, or takes too long, shouldn't stop the day from being measured without scaling.
+            for script, size in (("exit 1", "10"), ("sleep 10", "20")):
+                (scaling / "generate").write_text(f"#!/bin/sh\n{script}\n")
+                with (
+                    patch.dict(os.environ, {"SCALING": "true", "SCALING_SIZES": size, "TIMEOUT_SECONDS": "0.5"}),
+                    patch("builtins.print", autospec=True) as mock_print,
+                    main.scaled_inputs(scaling.parent) as actual,
+                ):
+                    self.assertEqual((), actual)
+                mock_print.assert_called_once_with(
+                    f"Not scaling day_01, as generate failed or timed out making generated_{size}.txt"
+                )
+
+    def test_link_input(self) -> None:
+        """Solutions should get a link to the input, whether or not it is on the same filesystem."""
+        with tempfile.TemporaryDirectory() as tmp:
+            input_file = Path(tmp, "shared.txt")
+            input_file.write_text("input")
+            solution_dir = Path(tmp, "python_iain")
+            solution_dir.mkdir()
+            (solution_dir / "input.txt").write_text("stale input")
+
+            main.link_input(input_file, solution_dir)
+            self.assertEqual(input_file.stat().st_ino, (solution_dir / "input.txt").stat().st_ino)
+
+            with patch("pathlib.Path.hardlink_to", side_effect=OSError("Invalid cross-device link")):
+                main.link_input(input_file, solution_dir)
+            self.assertTrue((solution_dir / "input.txt").is_symlink())
+            self.assertEqual("input", (solution_dir / "input.txt").read_text())
+
+    def test_prepare_input(self) -> None:
+        """The input should be read into, or taken out of, the page cache before each timed run."""
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual("", main.prepare_input(Path(tmp), "warm"))
+            Path(tmp, "input.txt").write_text("input")
+            self.assertEqual("warm", main.prepare_input(Path(tmp), "warm"))
+            # Whether or not the default temporary directory is in memory.
+            with (
+                patch("os.posix_fadvise", autospec=True) as mock_fadvise,
+                patch("advent_of_action.main.in_memory", return_value=False),
+            ):
+                self.assertEqual("cold", main.prepare_input(Path(tmp), "cold"))
+            mock_fadvise.assert_called_once_with(ANY, 0, 0, os.POSIX_FADV_DONTNEED)
+            with patch("advent_of_action.main.os", spec=["fsync"]):
+                self.assertEqual("", main.prepare_input(Path(tmp), "cold"))
+            with patch("advent_of_action.main.in_memory", return_value=True):
+                self.assertEqual("", main.prepare_input(Path(tmp), "cold"))
+
+            with patch.dict(os.environ, {"TIMEOUT_SECONDS": "10"}):
+                stat = main.measure_part(runners.Part.ONE, "input", ["cat", "input.txt"], Path(tmp))
+            self.assertEqual(("warm", ""), (stat.input_cache, stat.notes))
+
+    def test_input_cache(self) -> None:
+        """Inputs that are to be cold should be kept on disk, as they can't be taken out of memory."""
+        with patch.dict(os.environ, {"INPUT_CACHE": "cold"}), main.input_directory() as tmp:
+            self.assertEqual(Path.cwd(), Path(tmp).parent)
+        with patch.dict(os.environ, {"INPUT_CACHE": "warm"}), main.input_directory() as tmp:
+            self.assertEqual(os.access("/dev/shm", os.W_OK), tmp.startswith("/dev/shm"))
+        with patch.dict(os.environ, {"INPUT_CACHE": "lukewarm"}), self.assertRaises(ValueError):
+            main.input_cache()
+
+    def test_in_memory(self) -> None:
+        """Files on tmpfs, or any filesystem in memory, can't be taken out of the page cache."""
+        mounts = "/dev/sda1 / ext4 rw 0 0\nramdisk /mnt/my\\040ram ext4 rw 0 0\nramdisk /mnt/my\\040ram tmpfs rw 0 0\n"
+        with patch("pathlib.Path.read_text", return_value=mounts):
+            self.assertTrue(main.in_memory(Path("/mnt/my ram/input.txt")))
+            self.assertFalse(main.in_memory(Path("/mnt/other/input.txt")))
+        with patch("pathlib.Path.read_text", side_effect=FileNotFoundError):
+            self.assertFalse(main.in_memory(Path("/mnt/my ram/input.txt")))
 
 
 class TestLineCount(unittest.TestCase):
@@ -373,11 +823,957 @@ class TestLineCount(unittest.TestCase):
 
     def test_count_lines(self) -> None:
         """The count_lines func gives the expected answer."""
-        with main.chdir(Path("day_99/python_iain")):
-            self.assertEqual(14, main.count_lines("python"))
+        self.assertEqual(14, main.count_lines("python", Path("day_99/python_iain")))
+        self.assertEqual(2, main.count_lines("python", Path("day_99/python_zain")))
+
+    def test_count_lines_cached(self) -> None:
+        """We should skip build trees and vendored code, and only count files that have changed."""
+        with tempfile.TemporaryDirectory() as tmp:
+            solution_dir = Path(tmp)
+            for subdir in ("target", "vendor", "src"):
+                (solution_dir / subdir).mkdir()
+                (solution_dir / subdir / "lib.rs").write_text("fn main() {}\n")
+            counts: dict[str, store.FileCount] = {}
+            self.assertEqual(1, main.count_lines("rust", solution_dir, counts))
+            key = (solution_dir / "src" / "lib.rs").as_posix()
+            self.assertEqual([key], list(counts))
+
+            # Touched but unchanged files shouldn't be analysed again.
+            os.utime(key, ns=(0, 0))
+            with patch("pygount.SourceAnalysis.from_file", autospec=True) as mock_analysis:
+                self.assertEqual(1, main.count_lines("rust", solution_dir, counts))
+            mock_analysis.assert_not_called()
+            self.assertEqual(0, counts[key].mtime_ns)
+
+            Path(key).write_text("fn main() {}\nfn other() {}\n")
+            self.assertEqual(2, main.count_lines("rust", solution_dir, counts))
+
+            deleted = (solution_dir / "src" / "deleted.rs").as_posix()
+            lines, solution_counts, seconds = main.count_solution_lines(
+                "rust", solution_dir, counts | {deleted: store.FileCount(1, 1, "abc", 1)}
+            )
+            self.assertGreater(seconds, 0)
+            self.assertEqual(2, lines)
+            self.assertEqual(counts, solution_counts)
+            self.assertEqual(counts, store.solution_line_counts(counts, solution_dir))
+            self.assertEqual({}, store.solution_line_counts(counts, solution_dir / "src" / "lib"))
+
+    def test_line_counts_file(self) -> None:
+        """The line counts should survive being written and read back."""
+        with tempfile.TemporaryDirectory() as tmp, patch("advent_of_action.store.LINE_COUNTS", Path(tmp, "lines.json")):
+            self.assertEqual({}, store.read_line_counts())
+            counts = {"day_99/python_zain/solution.py": store.FileCount(10, 20, "abc", 2)}
+            store.write_line_counts(counts)
+            self.assertEqual(counts, store.read_line_counts())
+
 
-        with main.chdir(Path("day_99/python_zain")):
-            self.assertEqual(2, main.count_lines("python"))
+class TestCache(unittest.TestCase):
+    """Test the functions that decide whether a solution needs re-running."""
+
+    def test_runtime_version(self) -> None:
+        """We should get the toolchain version, if there's a command for it."""
+        self.assertTrue(main.runtime_version("python").startswith("Python 3."))
+        with patch.dict(main.RUNTIMES, {"cobol": Commands([], [], [])}):
+            self.assertEqual("", main.runtime_version("cobol"))
+
+    @patch("advent_of_action.main.runtime_version", return_value="1.0")
+    def test_solution_digest(self, _: MagicMock) -> None:
+        """The digest should change with the source but not with generated files."""
+        with tempfile.TemporaryDirectory() as tmp:
+            day_dir = Path(tmp, "day_01")
+            solution_dir = day_dir / "python_iain"
+            (solution_dir / "src").mkdir(parents=True)
+            for filename in ("input.gpg", "answers.gpg"):
+                (day_dir / filename).write_text(filename)
+            (solution_dir / "src" / "solution.py").write_text("print(1)")
+            digest = main.solution_digest(solution_dir, "python")
+
+            (solution_dir / "input.txt").write_text("some input")
+            (solution_dir / "target").mkdir()
+            (solution_dir / "target" / "solution").write_text("a binary")
+            self.assertEqual(digest, main.solution_digest(solution_dir, "python"))
+
+            (solution_dir / "src" / "solution.py").write_text("print(2)")
+            self.assertNotEqual(digest, main.solution_digest(solution_dir, "python"))
+
+    @patch("advent_of_action.main.runtime_version", return_value="1.0")
+    def test_solution_digest_ignored(self, _: MagicMock) -> None:
+        """The digest shouldn't change with files that building leaves behind, if git ignores them."""
+        with tempfile.TemporaryDirectory() as tmp:
+            subprocess.run(["git", "init", "-q", tmp], check=True)
+            Path(tmp, ".gitignore").write_text("Cargo.lock\n")
+            day_dir = Path(tmp, "day_01")
+            solution_dir = day_dir / "rust_iain"
+            solution_dir.mkdir(parents=True)
+            for filename in ("input.gpg", "answers.gpg"):
+                (day_dir / filename).write_text(filename)
+            (solution_dir / "Cargo.toml").write_text("[package]")
+            digest = main.solution_digest(solution_dir, "rust")
+
+            (solution_dir / "Cargo.lock").write_text("version = 3")
+            self.assertEqual(digest, main.solution_digest(solution_dir, "rust"))
+
+            # Files that aren't ignored count, even before they have been added.
+            (solution_dir / "build.rs").write_text("fn main() {}")
+            self.assertNotEqual(digest, main.solution_digest(solution_dir, "rust"))
+
+    def test_artifact_store(self) -> None:
+        """A solution's program should be kept, and used instead of building it, until its source changes."""
+        with tempfile.TemporaryDirectory() as tmp, patch.dict(os.environ, {"CACHE_DIR": tmp}):
+            solution_dir = Path(tmp, "day_01", "make_iain")
+            solution_dir.mkdir(parents=True)
+            (solution_dir / "Makefile").write_text("v1")
+            input_file = Path(tmp, "input.txt")
+            input_file.write_text("some input")
+            comm = Commands(["mkdir -p target && cat Makefile >target/program"], [], [], artifact="target/program")
+            with patch.dict(main.RUNTIMES, {"make": comm}):
+                self.assertEqual(Stat("", "", "Done"), main.build_solution(solution_dir, "make", input_file))
+                stored = list(Path(tmp, "artifacts").iterdir())
+                self.assertEqual(["v1"], [x.read_text() for x in stored])
+
+                shutil.rmtree(solution_dir / "target")
+                with patch("advent_of_action.main.build", autospec=True) as mock_build:
+                    self.assertEqual(Stat("", "", "Done"), main.build_solution(solution_dir, "make", input_file))
+                mock_build.assert_not_called()
+                self.assertEqual("v1", (solution_dir / "target" / "program").read_text())
+
+                (solution_dir / "Makefile").write_text("v2")
+                main.build_solution(solution_dir, "make", input_file)
+                self.assertEqual(2, len(list(Path(tmp, "artifacts").iterdir())))
+
+    def test_store(self) -> None:
+        """The store should keep every record, of which the last for each solution is current."""
+        with tempfile.TemporaryDirectory() as tmp, patch("advent_of_action.store.STORE", Path(tmp, "results.jsonl")):
+            self.assertEqual({}, store.read_store())
+            timeout = Stat("", "", "Timeout")
+            old = store.Record("day_01/python_iain", ("01", "python", "iain"), "abc", (timeout, timeout, 3))
+            other = old._replace(solution="day_01/python_zain", run=("01", "python", "zain"))
+            new = old._replace(
+                digest="def",
+                stats=(Stat("0.50", "1.0", "", samples=(store.Sample(0.5, 0.25, 1024),)), timeout, 4),
+                timestamp="2024-12-01T00:00:00+00:00",
+                commit="0123abc",
+                version="Python 3.12.0",
+                phases={"setup": 1.5, "one": 0.5},
+                machine_score=1.25,
+                settings={"warm_runtime": "True", "input_cache": "warm"},
+            )
+            store.append_to_store([old, other])
+            store.append_to_store([new])
+            self.assertDictEqual({old.solution: new, other.solution: other}, store.read_store())
+            self.assertEqual(3, len(Path(tmp, "results.jsonl").read_text().splitlines()))
+
+    def test_changed_since(self) -> None:
+        """We should find the solutions, and days, that have changed since a ref, if git can tell us."""
+        with tempfile.TemporaryDirectory() as tmp:
+            self.addCleanup(os.chdir, os.getcwd())
+            os.chdir(tmp)
+            git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+            subprocess.run(git + ["init", "-q"], check=True)
+            for filepath in (
+                "README.md",
+                "day_01/input.gpg",
+                "day_01/python_iain/solution.py",
+                "day_02/go_iain/go.mod",
+            ):
+                Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+                Path(filepath).write_text("")
+            subprocess.run(git + ["add", "."], check=True)
+            subprocess.run(git + ["commit", "-q", "-m", "Base"], check=True)
+            subprocess.run(git + ["tag", "base"], check=True)
+
+            self.assertEqual(set(), main.changed_since("base"))
+            for filepath in ("README.md", "day_01/input.gpg", "day_02/go_iain/go.mod"):
+                Path(filepath).write_text("changed")
+            subprocess.run(git + ["commit", "-q", "-a", "-m", "Change"], check=True)
+            self.assertEqual({Path("day_01"), Path("day_02/go_iain")}, main.changed_since("base"))
+
+            with patch("builtins.print", autospec=True) as mock_print:
+                self.assertIsNone(main.changed_since("nonexistent"))
+            mock_print.assert_called_once()
+
+    def test_current_commit(self) -> None:
+        """We should record the commit being measured, if there is one."""
+        self.assertRegex(main.current_commit(), "^[0-9a-f]{40}$")
+        with tempfile.TemporaryDirectory() as tmp:
+            self.addCleanup(os.chdir, os.getcwd())
+            os.chdir(tmp)
+            self.assertEqual("", main.current_commit())
+
+
+class TestRegressions(unittest.TestCase):
+    """Test the functions that compare a solution with its previous measurement."""
+
+    def test_slower(self) -> None:
+        """Times should only be slower if past the threshold and the floor and, if we can tell, significantly so."""
+        self.assertFalse(reports.slower([], [2.0], 0.1))
+        self.assertFalse(reports.slower([0.004], [0.0045], 0.1))
+        self.assertFalse(reports.slower([0.0], [0.01], 0.1))
+        self.assertFalse(reports.slower([0.01, 0.01], [0.02, 0.02], 0.1))
+        self.assertFalse(reports.slower([1.0], [1.1], 0.1))
+        self.assertTrue(reports.slower([1.0], [1.2], 0.1))
+        self.assertTrue(reports.slower([1.0, 1.01, 0.99], [2.0, 2.01, 1.99], 0.1))
+        self.assertTrue(reports.slower([1.0, 1.0], [2.0, 2.0], 0.1))
+        self.assertFalse(reports.slower([0.5, 1.0, 1.5], [1.0, 2.5, 0.9], 0.1))
+
+    def test_find_regressions(self) -> None:
+        """We should compare each part's time, from its samples if we have them, and memory."""
+        run = ("01", "python", "iain")
+        before = store.Record("day_01/python_iain", run, "abc", (Stat("1.00", "10.0", ""), Stat("", "", "Timeout"), 3))
+        samples = tuple(store.Sample(x, 0.5, 20480) for x in (2.0, 2.1, 1.9))
+        after = before._replace(stats=(Stat("2.00", "20.0", "", samples=samples), Stat("1.00", "10.0", ""), 3))
+        self.assertListEqual(
+            [
+                reports.Regression(run, runners.Part.ONE, "time (s)", 1.0, 2.0, tested=False),
+                reports.Regression(run, runners.Part.ONE, "mem (MiB)", 10.0, 20.0),
+            ],
+            reports.find_regressions(before, after, "cpu_seconds", 0.1),
+        )
+        self.assertListEqual([], reports.find_regressions(before, after, "wall_seconds", 1.5))
+
+        # Both timed more than once, but too little more memory to count.
+        old_samples = tuple(store.Sample(x, 0.5, 10240) for x in (1.0, 1.1, 0.9))
+        sampled_before = before._replace(stats=(Stat("1.00", "10.0", "", samples=old_samples), *before.stats[1:]))
+        sampled_after = after._replace(stats=(Stat("2.00", "14.0", "", samples=samples), *after.stats[1:]))
+        self.assertEqual(
+            reports.Regression(run, runners.Part.ONE, "time (s)", 1.0, 2.0),
+            *reports.find_regressions(sampled_before, sampled_after, "cpu_seconds", 0.1),
+        )
+
+        # Measured on a machine twice as fast, so it would have taken 2s on this one.
+        before, after = before._replace(machine_score=2.0), after._replace(machine_score=1.0)
+        self.assertEqual(
+            reports.Regression(run, runners.Part.ONE, "mem (MiB)", 10.0, 20.0),
+            *reports.find_regressions(before, after, "cpu_seconds", 0.1),
+        )
+
+    def test_normalised(self) -> None:
+        """Times should be scaled by the score of the machine they were measured on, if we know it."""
+        stats = (Stat("1.50", "10.0", ""), Stat("", "", "Timeout"), 3)
+        record = store.Record("day_01/python_iain", ("01", "python", "iain"), "abc", stats)
+        self.assertEqual(stats, store.normalised(record))
+        one, two, lines = store.normalised(record._replace(machine_score=0.5))
+        self.assertEqual(("0.75", "", 3), (one.normalised_seconds, two.normalised_seconds, lines))
+        self.assertIn("| norm (s) |", reports.to_table({record.run: (one, two, lines)}))
+
+    def test_ranked(self) -> None:
+        """The README should show the time of the current RANKING_METRIC, whichever a part was measured with."""
+        samples = tuple(store.Sample(x, x / 2, 1024) for x in (1.0, 2.0, 3.0))
+        stat = Stat("2.00", "1.0", "", "1.00", "1.00", "3", "2.00", "1.00", samples=samples)
+        record = store.Record("day_01/python_iain", ("01", "python", "iain"), "abc", (stat, stat, 3), machine_score=2.0)
+        with patch.dict(os.environ, {"RANKING_METRIC": "wall"}):
+            one, _, _ = store.normalised(record)
+        self.assertEqual(
+            ("1.00", "0.50", "0.50", "2.00"), (one.seconds, one.min_seconds, one.stdev_seconds, one.normalised_seconds)
+        )
+        self.assertEqual(stat, store.ranked(stat, "cpu_seconds"))
+        self.assertEqual(
+            stat._replace(seconds="1.00", samples=()), store.ranked(stat._replace(samples=()), "wall_seconds")
+        )
+        readme = Stat("1.50", "1.0", "")
+        self.assertEqual(readme, store.ranked(readme, "wall_seconds"))
+
+    def test_report_machines(self) -> None:
+        """Results from a materially faster, or slower, machine should be called out."""
+        stats = (Stat("1.50", "10.0", ""), Stat("", "", "Timeout"), 3)
+        records = [
+            store.Record(f"day_01/python_{x}", ("01", "python", x), "", stats, commit="0123abc", machine_score=score)
+            for x, score in (("iain", 1.1), ("zain", 1.5), ("tim", 0.0))
+        ]
+        with tempfile.TemporaryDirectory() as tmp, patch("builtins.print", autospec=True) as mock_print:
+            summary = Path(tmp, "summary.md")
+            with patch.dict(os.environ, {"GITHUB_STEP_SUMMARY": str(summary)}):
+                reports.report_machines(records[::2], 1.0)
+                self.assertFalse(summary.exists())
+                reports.report_machines(records, 1.0)
+            report = reports.machine_report(records[1:2], 1.0)
+            self.assertEqual(report, summary.read_text())
+            mock_print.assert_called_once_with(report)
+        self.assertIn("This machine scores 1.00.", report)
+        self.assertIn("| 01 | python | zain | 1.50 | 0123abc |", report)
+
+    def test_report_regressions(self) -> None:
+        """Regressions should be printed, added to the job summary and, if asked for, fail the run."""
+        regressions = [
+            reports.Regression(("01", "python", "iain"), runners.Part.TWO, "time (s)", 1.0, 1.5),
+            reports.Regression(("01", "python", "iain"), runners.Part.TWO, "mem (MiB)", 0.0, 1.5),
+        ]
+        report = reports.regression_report(regressions)
+        self.assertIn("| 01 | python | iain | two | time (s) | 1.00 | 1.50 | +50% |", report)
+        self.assertIn("| 01 | python | iain | two | mem (MiB) | 0.00 | 1.50 |  |", report)
+        self.assertNotIn("†", report)
+
+        with tempfile.TemporaryDirectory() as tmp, patch("builtins.print", autospec=True) as mock_print:
+            summary = Path(tmp, "summary.md")
+            with patch.dict(os.environ, {"GITHUB_STEP_SUMMARY": str(summary), "FAIL_ON_REGRESSION": "true"}):
+                reports.report_regressions([])
+                self.assertFalse(summary.exists())
+                with self.assertRaises(SystemExit):
+                    reports.report_regressions(regressions)
+            self.assertEqual(report, summary.read_text())
+            mock_print.assert_called_once_with(report)
+
+            with patch.dict(os.environ, {"GITHUB_STEP_SUMMARY": "", "FAIL_ON_REGRESSION": "false"}):
+                reports.report_regressions(regressions)
+
+            # Times from a single run can't be tested for significance, so are reported but not failed on.
+            untested = [regressions[0]._replace(tested=False)]
+            with patch.dict(os.environ, {"GITHUB_STEP_SUMMARY": "", "FAIL_ON_REGRESSION": "true"}):
+                reports.report_regressions(untested)
+            self.assertIn("| +50% † |", reports.regression_report(untested))
+            self.assertIn("not tested for significance", reports.regression_report(untested))
+
+    def test_report_counters(self) -> None:
+        """Each day's hardware counters should be reported, if there are any, and added to the summary."""
+        counters = {"instructions": 3000.0, "cycles": 1000.0, "ipc": 3.0, "page_faults": 12.0}
+        stats = (Stat("1.00", "1.0", "", counters=counters), Stat("", "", "Timeout"), 1)
+        records = [
+            store.Record("day_02/rust_iain", ("02", "rust", "iain"), "", stats),
+            store.Record("day_01/python_iain", ("01", "python", "iain"), "", stats),
+        ]
+        report = reports.counter_report(records)
+        lines = report.splitlines()
+        self.assertEqual("### Day 01", lines[2])
+        self.assertEqual(
+            "| language | who | part | instructions | cycles | IPC | cache misses | branch misses | page faults | ",
+            lines[4],
+        )
+        self.assertEqual("| python | iain | one | 3,000 | 1,000 | 3.00 |  |  | 12 | ", lines[6])
+        self.assertEqual("### Day 02", lines[8])
+        self.assertNotIn("| two |", report)
+
+        with tempfile.TemporaryDirectory() as tmp, patch("builtins.print", autospec=True) as mock_print:
+            summary = Path(tmp, "summary.md")
+            with patch.dict(os.environ, {"GITHUB_STEP_SUMMARY": str(summary)}):
+                reports.report_counters([])
+                self.assertFalse(summary.exists())
+                reports.report_counters(records)
+            self.assertEqual(report, summary.read_text())
+            mock_print.assert_called_once_with(report)
+
+    def test_report_phases(self) -> None:
+        """The time spent in each phase should be totalled, by language and by person, and added to the summary."""
+        records = [
+            store.Record(
+                "day_01/python_iain", ("01", "python", "iain"), "", (Stat("", "", ""), Stat("", "", ""), 1), phases=x
+            )
+            for x in ({"setup": 2.0, "one": 0.5}, {"setup": 1.0, "lines": 0.25})
+        ]
+        records[1] = records[1]._replace(run=("02", "rust", "iain"))
+        report = reports.phase_report(records)
+        rows = report.splitlines()[2:]
+        self.assertEqual("| by | name | setup (s) | one (s) | lines (s) | total (s) |", rows[0])
+        self.assertEqual("| all |  | 3.00 | 0.50 | 0.25 | 3.75 |", rows[2])
+        self.assertIn("| language | rust | 1.00 | 0.00 | 0.25 | 1.25 |", rows)
+        self.assertIn("| who | iain | 3.00 | 0.50 | 0.25 | 3.75 |", rows)
+
+        with tempfile.TemporaryDirectory() as tmp, patch("builtins.print", autospec=True) as mock_print:
+            summary = Path(tmp, "summary.md")
+            with patch.dict(os.environ, {"GITHUB_STEP_SUMMARY": str(summary)}):
+                reports.report_phases([])
+                self.assertFalse(summary.exists())
+                reports.report_phases(records)
+            self.assertEqual(report, summary.read_text())
+            mock_print.assert_called_once_with(report)
+
+
+class TestScheduling(unittest.TestCase):
+    """Test the functions that spread solutions across CPUs."""
+
+    @unittest.skipUnless(AFFINITY, "No CPU affinity (e.g. on macOS).")
+    def test_available_cpus(self) -> None:
+        """We should only offer CPUs that we're allowed to run on."""
+        self.assertListEqual(sorted(os.sched_getaffinity(0)), main.available_cpus(False))
+
+    @unittest.skipUnless(AFFINITY, "No CPU affinity (e.g. on macOS).")
+    @patch("os.sched_getaffinity", return_value={0, 1, 2, 3})
+    def test_available_cpus_physical(self, _: MagicMock) -> None:
+        """We should offer one CPU per physical core."""
+
+        def read_text(path: Path) -> str:
+            if path.parts[-3] == "cpu3":
+                raise OSError("No topology")
+            # CPUs 0 and 2 are hyperthreads of core 0, 1 is core 1.
+            return "0" if path.name == "physical_package_id" else str(int(path.parts[-3][3:]) % 2)
+
+        with patch("pathlib.Path.read_text", autospec=True, side_effect=read_text):
+            self.assertListEqual([0, 1, 3], main.available_cpus(True))
+
+    @unittest.skipUnless(AFFINITY, "No CPU affinity (e.g. on macOS).")
+    @patch("os.sched_setaffinity")
+    def test_pin_thread(self, mock_setaffinity: MagicMock) -> None:
+        """Each worker should take CPUs of its own."""
+        cpus: SimpleQueue[set[int]] = SimpleQueue()
+        cpus.put({2, 3})
+        main.pin_thread(cpus)
+        mock_setaffinity.assert_called_once_with(0, {2, 3})
+        self.assertTrue(cpus.empty())
+
+    def test_share_cpus(self) -> None:
+        """Timing workers should get equal shares of the CPUs, leaving at least one to build on, if there's more."""
+        self.assertEqual(([{0, 1, 2}], {3}), main.share_cpus([0, 1, 2, 3], 1))
+        self.assertEqual(([{0}, {1}, {2}], {3}), main.share_cpus([0, 1, 2, 3], 8))
+        self.assertEqual(([{0, 1}, {2, 3}], {4, 5}), main.share_cpus(list(range(6)), 2))
+        self.assertEqual(([{0}], set()), main.share_cpus([0], 2))
+
+    @patch("advent_of_action.main.measure_solution", autospec=True)
+    @patch("advent_of_action.main.build_solution", autospec=True)
+    def test_build_before_timing(self, mock_build: MagicMock, mock_measure: MagicMock) -> None:
+        """With only one CPU, every solution should be built before any is timed, rather than while they are."""
+        events: list[str] = []
+
+        def build(*_: object) -> Stat:
+            time.sleep(0.1)
+            events.append("build")
+            return Stat("", "", "Done")
+
+        mock_build.side_effect = build
+        mock_measure.side_effect = lambda *_: events.append("time") or (Stat("", "", ""), Stat("", "", ""))
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs: list[main.Job] = []
+            for person in ("iain", "zain"):
+                solution_dir = Path(tmp, f"python_{person}")
+                solution_dir.mkdir()
+                jobs.append((("99", "python", person), solution_dir, ("", ""), Path(tmp, "input.txt"), ()))
+            cpu = min(main.allowed_cpus())
+            with patch("advent_of_action.main.available_cpus", return_value=[cpu]):
+                main.run_solutions(jobs)
+        self.assertListEqual(["build", "build", "time", "time"], events)
+
+    def run_sharing_cpus(self, answers: main.Answers) -> tuple[Stat, Stat]:
+        """Run a solution with run_solutions, which says how many CPUs it may use and then uses two at once."""
+        with tempfile.TemporaryDirectory() as tmp:
+            solution_dir = Path(tmp, "python_iain")
+            solution_dir.mkdir()
+            (solution_dir / "solution.py").write_text(
+                "import multiprocessing, os, sys, time\n"
+                "def spin():\n"
+                "    end = time.process_time() + 0.5\n"
+                "    while time.process_time() < end:\n"
+                "        pass\n"
+                "if sys.argv[-1] == 'one':\n"
+                "    print(len(os.sched_getaffinity(0)))\n"
+                "else:\n"
+                "    workers = [multiprocessing.Process(target=spin) for _ in range(2)]\n"
+                "    for worker in workers:\n"
+                "        worker.start()\n"
+                "    for worker in workers:\n"
+                "        worker.join()\n"
+                "    print('two')\n"
+            )
+            input_file = Path(tmp, "input.txt")
+            input_file.write_text("")
+            job = (("99", "python", "iain"), solution_dir, answers, input_file, ())
+            commands = Commands([], [sys.executable, "solution.py", "{part}"], [])
+            with patch.dict(main.RUNTIMES, {"python": commands}), patch.dict(os.environ, {"TIMEOUT_SECONDS": "30"}):
+                one, two, _ = main.run_solutions([job])[job[0]]
+        return one, two
+
+    @unittest.skipUnless(AFFINITY, "No CPU affinity (e.g. on macOS).")
+    def test_affinity_of_solutions(self) -> None:
+        """A single timing worker should leave the solutions it runs every CPU but the one kept for building."""
+        one, _ = self.run_sharing_cpus((str(max(1, len(main.allowed_cpus()) - 1)), "two"))
+        self.assertEqual("", one.notes)
+
+    def test_parallel_solution(self) -> None:
+        """A solution that uses two CPUs at once should have a parallelism of more than one."""
+        if len(main.allowed_cpus()) < 2:
+            self.skipTest("Needs more than one CPU.")
+        _, two = self.run_sharing_cpus(("1", "two"))
+        self.assertGreater(float(two.parallelism), 1.5)
+
+    def test_without_affinity(self) -> None:
+        """We should still run, unpinned, where the OS doesn't support CPU affinity (e.g. macOS)."""
+        with patch("advent_of_action.main.os", spec=["cpu_count"]) as mock_os:
+            mock_os.cpu_count.return_value = 2
+            self.assertSetEqual({0, 1}, main.allowed_cpus())
+            main.restrict_thread({0})
+
+
+class TestRunners(unittest.TestCase):
+    """Test running commands and measuring their resource usage."""
+
+    @patch("sys.platform", "darwin")
+    def test_become_subreaper(self) -> None:
+        """Only Linux lets us adopt orphaned processes."""
+        runners.become_subreaper.cache_clear()
+        try:
+            self.assertFalse(runners.become_subreaper())
+        finally:
+            runners.become_subreaper.cache_clear()
+
+    def test_memory(self) -> None:
+        """A command's peak memory shouldn't include ours."""
+        ballast = bytearray(200 * 1024 * 1024)
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+        actual = runners.execute_command(["true"], timeout=10)
+        self.assertLess(actual.kibytes, 100 * 1024)
+
+    @patch("advent_of_action.runners.become_subreaper", return_value=False)
+    def test_spawn_without_subreaper(self, _: MagicMock) -> None:
+        """We should reap the shell if we can't reap the command."""
+        shell, pid = runners.spawn("echo hello", None)
+        self.assertEqual(shell.pid, pid)
+        self.assertEqual(("hello\n", ""), shell.communicate())
+
+    def test_spawn_syntax_error(self) -> None:
+        """We should reap the shell if it couldn't start the command."""
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            runners.execute_command(["echo", '"'], timeout=10)
+        self.assertEqual(2, context.exception.returncode)
+        self.assertTrue(context.exception.stderr)
+
+    def test_timeout(self) -> None:
+        """We should kill a command, and anything it started, when it runs out of time."""
+        with self.assertRaises(subprocess.TimeoutExpired):
+            runners.execute_command(["sleep", "10;", "echo", "late"], timeout=0.2)
+
+        # Nor should anything it left running, or that has left its process group, keep us waiting for its output.
+        start = time.perf_counter()
+        self.assertEqual("hi", runners.execute_command(["(sleep 8 &) ; echo hi"], timeout=2).stdout)
+        if shutil.which("setsid"):
+            self.assertEqual("hi", runners.execute_command(["setsid sleep 8 & echo hi"], timeout=20).stdout)
+        self.assertLess(time.perf_counter() - start, 5)
+
+        # The command may already have finished.
+        finished = subprocess.Popen(["true"], start_new_session=True)
+        finished.wait()
+        timed_out = threading.Event()
+        runners.kill_group(finished.pid, timed_out)
+        self.assertTrue(timed_out.is_set())
+
+    def test_wrong_answer(self) -> None:
+        """We should stop a command as soon as the first line it prints isn't the answer."""
+        actual = runners.execute_command(["echo wrong; sleep 10; echo late"], timeout=20, answer="right")
+        self.assertEqual("wrong", actual.stdout)
+        self.assertLess(actual.wall_seconds, 5)
+        first_output_seconds = actual.first_output_seconds
+        assert first_output_seconds is not None
+        self.assertLessEqual(first_output_seconds, actual.wall_seconds)
+
+        # The right answer, or a command without one, should run to the end.
+        actual = runners.execute_command(["echo; echo ' right '; echo more"], timeout=20, answer="right")
+        self.assertEqual("right \nmore", actual.stdout)
+        self.assertIsNone(runners.execute_command(["true"], timeout=20).first_output_seconds)
+
+    @patch("advent_of_action.runners.kill_group", autospec=True)
+    def test_stdout_watcher(self, mock_kill: MagicMock) -> None:
+        """We should only kill a command once we can tell that its answer is wrong."""
+        watcher = runners.StdoutWatcher(1234, 0, "123")
+        for chunk in ("\n", "  12", "3  "):
+            watcher(chunk)
+        mock_kill.assert_not_called()
+        watcher("4")
+        mock_kill.assert_called_once_with(1234, watcher.wrong)
+        watcher("\n")
+        mock_kill.assert_called_once()
+
+        # Answers of more than one line can only be checked at the end.
+        watcher = runners.StdoutWatcher(1234, 0, "1\n2")
+        watcher("3\n")
+        mock_kill.assert_called_once()
+        self.assertIsNotNone(watcher.first_output_ns)
+
+    @patch("advent_of_action.runners.MAX_CAPTURED", 8)
+    def test_read_capped(self) -> None:
+        """We should keep the start and end of a command's output, but not too much of it."""
+        self.assertEqual("a\nb", asyncio.run(runners.read_capped(fake_pipe("a\nb"))))
+        captured = runners.CappedOutput()
+        for chunk in ["a\n"] * 20:
+            captured.add(chunk)
+        self.assertEqual("a\na\n\n[32 characters not kept]\na\na\n", str(captured))
+
+    def test_read_perf_stat(self) -> None:
+        """We should keep the events perf stat counted, adding up those counted on each kind of core."""
+        text = (
+            "# started on Tue Dec  3 06:00:00 2024\n\n"
+            "1234,,instructions:u,1000,100.00,,\n"
+            "<not supported>,,cycles:u,0,100.00,,\n"
+            "10,,cpu_core/cache-misses/u,1000,100.00,,\n"
+            "5,,cpu_atom/cache-misses/u,1000,100.00,,\n"
+            "7,,page-faults:u,1000,100.00,7.000 /sec,\n"
+            "0.99,msec,task-clock:u,1000,100.00,0.990,CPUs utilized\n"
+        )
+        self.assertEqual({"instructions": 1234, "cache_misses": 15, "page_faults": 7}, runners.read_perf_stat(text))
+        self.assertEqual(
+            ["perf", "stat", "-x,", "-o", Path("perf.csv"), "-e", ",".join(runners.PERF_EVENTS), "--", "sh", "-c"],
+            runners.perf_command(["./solution", "{part}"], Path("perf.csv"))[:-1],
+        )
+        self.assertEqual("'./solution {part}'", runners.perf_command(["./solution", "{part}"], Path("perf.csv"))[-1])
+
+    @patch("advent_of_action.runners.subprocess.run", autospec=True)
+    @patch("advent_of_action.runners.shutil.which", autospec=True)
+    def test_perf_available(self, mock_which: MagicMock, mock_run: MagicMock) -> None:
+        """We can only count events if perf is installed and we're allowed to use it."""
+        mock_which.return_value = None
+        runners.perf_available.cache_clear()
+        self.assertFalse(runners.perf_available())
+        mock_which.return_value = "/usr/bin/perf"
+        mock_run.return_value.returncode = 0
+        runners.perf_available.cache_clear()
+        self.assertTrue(runners.perf_available())
+        runners.perf_available.cache_clear()
+
+    def test_reap(self) -> None:
+        """We should wait for a process to exit, with or without pidfds, and get its resource usage."""
+        process = subprocess.Popen(["sleep", "0.1"])
+        pid, status, usage = asyncio.run(runners.reap(process.pid))
+        process.returncode = 0
+        self.assertEqual((process.pid, 0), (pid, status))
+        self.assertGreater(usage.ru_maxrss, 0)
+
+        process = subprocess.Popen(["sh", "-c", "exit 3"])
+        with patch("advent_of_action.runners.os", spec=["wait4"], wait4=os.wait4):
+            _, status, _ = asyncio.run(runners.reap(process.pid))
+        process.returncode = 3
+        self.assertEqual(3, os.waitstatus_to_exitcode(status))
+
+    def test_cancel(self) -> None:
+        """Cancelling a command's task should kill the command, and anything it started."""
+
+        async def cancel() -> float:
+            start = time.perf_counter()
+            task = asyncio.create_task(runners.execute_command_async(["sleep 10 & sleep 10"], timeout=20))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return time.perf_counter() - start
+
+        self.assertLess(asyncio.run(cancel()), 5)
+
+    def test_concurrent(self) -> None:
+        """Commands can run at once, as tasks in one event loop, each with its own timeout."""
+
+        async def run_both() -> list[runners.Measurement | BaseException]:
+            return list(
+                await asyncio.gather(
+                    runners.execute_command_async(["sleep 0.5; echo one"], timeout=20),
+                    runners.execute_command_async(["sleep 0.5; echo two"], timeout=20),
+                    runners.execute_command_async(["sleep 10"], timeout=0.2),
+                    return_exceptions=True,
+                )
+            )
+
+        start = time.perf_counter()
+        one, two, late = asyncio.run(run_both())
+        self.assertLess(time.perf_counter() - start, 5)
+        assert isinstance(one, runners.Measurement) and isinstance(two, runners.Measurement)
+        self.assertEqual(("one", "two"), (one.stdout, two.stdout))
+        self.assertIsInstance(late, subprocess.TimeoutExpired)
+
+    def test_cgroup(self) -> None:
+        """We should apply a sandbox's limits and remove its cgroups, even if they take a moment to empty."""
+        with tempfile.TemporaryDirectory() as root:
+            group = Path(root, "run_1")
+            group.mkdir()
+            (group / "memory.swap.max").write_text("max")
+            with (
+                patch("tempfile.mkdtemp", autospec=True, return_value=str(group)) as mock_mkdtemp,
+                patch("pathlib.Path.rmdir", autospec=True, side_effect=[OSError("Device or resource busy"), None]),
+                runners.cgroup(runners.Sandbox(Path(root), 256, 1.5)) as actual,
+            ):
+                self.assertEqual(group, actual)
+                self.assertEqual("268435456", (group / "memory.max").read_text())
+                self.assertEqual("0", (group / "memory.swap.max").read_text())
+                self.assertEqual("1", (group / "memory.oom.group").read_text())
+                self.assertEqual("150000 100000", (group / "cpu.max").read_text())
+            mock_mkdtemp.assert_called_once_with(prefix="run_", dir=Path(root))
+            self.assertEqual("1", (group / "cgroup.kill").read_text())
+
+    def test_sandboxed(self) -> None:
+        """A sandboxed command should join its cgroup and be measured by it."""
+        with tempfile.TemporaryDirectory() as group:
+            Path(group, "cgroup.procs").write_text("")
+            Path(group, "cpu.stat").write_text("usage_usec 2500000\nuser_usec 2000000\nnr_throttled 3\n")
+            Path(group, "memory.peak").write_text("104857600\n")
+            with patch("advent_of_action.runners.cgroup", autospec=True, return_value=nullcontext(Path(group))):
+                actual = runners.execute_command(["echo", "hi"], timeout=10, sandbox=runners.Sandbox(Path("/")))
+                expected = runners.Measurement(
+                    102400, 2.5, "hi", actual.wall_seconds, True, actual.first_output_seconds
+                )
+                self.assertEqual(expected, actual)
+                self.assertEqual("0\n", Path(group, "cgroup.procs").read_text())
+
+                Path(group, "memory.events").write_text("oom 1\noom_kill 1\n")
+                with self.assertRaises(runners.OutOfMemory):
+                    runners.execute_command(["exit", "137"], timeout=10, sandbox=runners.Sandbox(Path("/")))
+
+
+class TestWarm(unittest.TestCase):
+    """Test the warm runtimes, which run scripts without starting up each time."""
+
+    def setUp(self) -> None:
+        """Make a directory for the scripts."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def script(self, source: str) -> str:
+        """Write a script to the directory and return its name."""
+        Path(self.directory.name, "solution.py").write_text(source)
+        return "solution.py"
+
+    def run_child(self, run: warm.Runner) -> dict[str, object]:
+        """Run a script as a warm runtime's child would, but without forking."""
+        read_fd, write_fd = os.pipe()
+        warm.run_child(run, "solution.py", ["one"], write_fd)
+        with os.fdopen(read_fd) as pipe:
+            return json.loads(pipe.read())
+
+    def test_run_child(self) -> None:
+        """We should report a script's output, exit code and times."""
+        actual = self.run_child(lambda: print(" ".join(sys.argv)))
+        self.assertEqual(
+            {"returncode": 0, "stdout": "solution.py one\n", "stderr": ""},
+            {x: actual[x] for x in ("returncode", "stdout", "stderr")},
+        )
+        self.assertIsInstance(actual["wall_seconds"], float)
+
+        def exit_with(code: int | str | None) -> warm.Runner:
+            def run() -> None:
+                raise SystemExit(code)
+
+            return run
+
+        self.assertEqual(0, self.run_child(exit_with(None))["returncode"])
+        self.assertEqual(2, self.run_child(exit_with(2))["returncode"])
+        actual = self.run_child(exit_with("Oops"))
+        self.assertEqual((1, "Oops\n"), (actual["returncode"], actual["stderr"]))
+
+        def fail() -> None:
+            raise ZeroDivisionError("division by zero")
+
+        actual = self.run_child(fail)
+        self.assertEqual(1, actual["returncode"])
+        self.assertIn("ZeroDivisionError", str(actual["stderr"]))
+
+    def test_load(self) -> None:
+        """We should compile scripts, and run notebooks, ahead of time."""
+        jupyter = Path("day_99/jupyter_iain/solution.ipynb").absolute()
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+        actual = self.run_child(warm.load(self.script("import sys\nprint(__name__, sys.argv[-1])\n")))
+        self.assertEqual("__main__ one\n", actual["stdout"])
+        shutil.copy(jupyter, "solution.ipynb")
+        actual = self.run_child(warm.load("solution.ipynb"))
+        self.assertEqual("answer\n", actual["stdout"])
+
+        # A notebook that uses IPython should have it started before it is run, as that isn't to be timed.
+        from IPython.core.interactiveshell import InteractiveShell
+
+        InteractiveShell.clear_instance()
+        self.addCleanup(InteractiveShell.clear_instance)
+        source = ["def echo():\n    answer = !echo hello\n    return answer"]
+        cells = [{"cell_type": "code", "metadata": {}, "outputs": [], "source": source}]
+        Path("magic.ipynb").write_text(json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 2}))
+        self.assertFalse(notebook.uses_ipython(notebook.compile_notebook(jupyter)))
+        # IPython replaces __main__, which spawned processes in later tests would otherwise try to import.
+        with patch.dict(sys.modules):
+            warm.load("magic.ipynb")
+        self.assertTrue(InteractiveShell.initialized())
+
+    @patch.dict(os.environ, {"TIMEOUT_SECONDS": "10"})
+    def test_warm_venv(self) -> None:
+        """A warm runtime should run in the solution's environment, if it has one, though we aren't installed in it."""
+        python = Path(self.directory.name, venvs.VENV, "bin", "python")
+        python.parent.mkdir(parents=True)
+        # The real interpreter, rather than any virtual environment that we might be installed in.
+        python.symlink_to(Path(sys.executable).resolve())
+        script = self.script("print('hi')\n")
+        runtime = warm.WarmRuntime(script, Path(self.directory.name))
+        self.addCleanup(runtime.close)
+        self.assertEqual("hi", runtime.run([]).stdout)
+        server = runtime.server
+        assert server is not None
+        self.assertEqual([str(python), "-m", "advent_of_action.warm", script], server.args)
+
+    def test_serve(self) -> None:
+        """The server should fork to run the script for each request."""
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+        replies = io.StringIO()
+        warm.serve(self.script("import os, sys\nos._exit(int(sys.argv[-1]))\n"), io.StringIO('["3"]\n'), replies)
+        ready, reply = replies.getvalue().splitlines()
+        self.assertEqual("ready", ready)
+        self.assertEqual(3, json.loads(reply)["returncode"])
+        self.assertGreater(json.loads(reply)["kibytes"], 0)
+
+    @patch.dict(os.environ, {"TIMEOUT_SECONDS": "10"})
+    def test_warm_runtime(self) -> None:
+        """A warm runtime should run a script repeatedly, restarting if it has to."""
+        script = self.script(
+            "import sys, time\ntime.sleep(float(sys.argv[-1]))\nprint(sys.argv[-1])\nexit(len(sys.argv) - 2)\n"
+        )
+        runtime = warm.WarmRuntime(script, Path(self.directory.name))
+        self.addCleanup(runtime.close)
+        actual = runtime.run(["0"])
+        self.assertEqual("0", actual.stdout)
+        self.assertGreater(actual.kibytes, 0)
+        server = runtime.server
+        self.assertEqual("0.01", runtime.run(["0.01"]).stdout)
+        self.assertIs(server, runtime.server)
+
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            runtime.run(["0", "1"])
+        self.assertEqual((1, "1\n"), (context.exception.returncode, context.exception.output))
+
+        with self.assertRaises(subprocess.TimeoutExpired):
+            runtime.run(["10"], timeout=0.5)
+        self.assertIsNone(runtime.server)
+        self.assertEqual("0", runtime.run(["0"]).stdout)
+
+    @patch.dict(os.environ, {"TIMEOUT_SECONDS": "10"})
+    def test_warm_stdin(self) -> None:
+        """A warm run's stdin should be empty, as a cold run's is, rather than the server's requests."""
+        runtime = warm.WarmRuntime(
+            self.script("import os, sys\nprint(repr(sys.stdin.read()), os.read(0, 1))\n"), Path(self.directory.name)
+        )
+        self.addCleanup(runtime.close)
+        self.assertEqual("'' b''", runtime.run(["one"], timeout=5).stdout)
+
+    def test_warm_runtime_dies(self) -> None:
+        """We should say if a warm runtime dies or doesn't start."""
+        runtime = warm.WarmRuntime(self.script("import os\nos.kill(os.getppid(), 9)\n"), Path(self.directory.name))
+        with self.assertRaises(subprocess.CalledProcessError):
+            runtime.run(["one"], timeout=10)
+        self.assertIsNone(runtime.server)
+
+        runtime.server = MagicMock(**{"poll.return_value": None, "stdin.write.side_effect": BrokenPipeError})
+        with self.assertRaises(subprocess.CalledProcessError):
+            runtime.run(["one"], timeout=10)
+
+        runtime = warm.WarmRuntime(self.script("syntax error"), Path(self.directory.name))
+        with self.assertRaises(subprocess.CalledProcessError):
+            runtime.run(["one"], timeout=10)
+
+
+class TestCalibration(unittest.TestCase):
+    """Test scoring how fast a machine is."""
+
+    def test_machine_score(self) -> None:
+        """A machine that runs both workloads twice as fast as the reference should score 2.0."""
+        times = {calibration.cpu_workload: 0.05, calibration.memory_workload: 0.05}
+        with patch("advent_of_action.calibration.fastest", autospec=True, side_effect=times.get):
+            self.assertAlmostEqual(2.0, calibration.machine_score())
+        self.assertGreater(calibration.fastest(calibration.memory_workload), 0.0)
+        self.assertEqual(calibration.cpu_workload(), calibration.cpu_workload())
+
+
+class TestVenvs(unittest.TestCase):
+    """Tests for the shared Python environments."""
+
+    def setUp(self) -> None:
+        """Make a solution, with requirements, and a cache for its environment."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = Path(self.directory.name, "cache")
+        self.solution = Path(self.directory.name, "python_tim")
+        self.solution.mkdir()
+        (self.solution / "requirements.txt").write_text("# Nothing yet.\n")
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.solution)
+
+    def test_main(self) -> None:
+        """Solutions with the same requirements should share an environment, which is only made once."""
+        with patch.dict(os.environ, {"CACHE_DIR": str(self.cache)}):
+            venvs.main()
+            link = Path(venvs.VENV)
+            environment = link.readlink()
+            self.assertTrue((link / "bin" / "python").exists())
+            self.assertEqual(self.cache / "envs", environment.parent)
+            with patch("venv.create", autospec=True) as mock_create:
+                venvs.main()
+            mock_create.assert_not_called()
+            self.assertEqual(environment, link.readlink())
+
+            # Without requirements, there is no environment.
+            Path("requirements.txt").unlink()
+            venvs.main()
+            self.assertFalse(link.exists() or link.is_symlink())
+
+    @patch("subprocess.run", autospec=True)
+    def test_install(self, mock_run: MagicMock) -> None:
+        """Requirements that aren't in the wheel cache should be added to it."""
+        mock_run.side_effect = [MagicMock(returncode=1), MagicMock(returncode=0), MagicMock(returncode=0)]
+        venvs.install(Path("requirements.txt"), Path("env"), Path("wheels"))
+        install, wheel, install_again = (the_call.args[0] for the_call in mock_run.call_args_list)
+        self.assertEqual(install, install_again)
+        self.assertIn("--no-index", install)
+        self.assertEqual([sys.executable, "-m", "pip", "wheel"], wheel[:4])
+        self.assertEqual("wheels", wheel[wheel.index("--wheel-dir") + 1])
+
+        mock_run.side_effect = None
+        mock_run.reset_mock()
+        mock_run.return_value = MagicMock(returncode=0)
+        venvs.install(Path("requirements.txt"), Path("env"), Path("wheels"))
+        mock_run.assert_called_once()
+
+    def test_environment_key(self) -> None:
+        """Environments should depend on the requirements."""
+        before = venvs.environment_key(Path("requirements.txt"))
+        Path("requirements.txt").write_text("numpy\n")
+        self.assertNotEqual(before, venvs.environment_key(Path("requirements.txt")))
+        with patch.dict(os.environ):
+            os.environ.pop("CACHE_DIR", None)
+            self.assertEqual(Path.home() / ".cache" / "advent_of_action", venvs.cache_dir())
+
+
+class TestNotebook(unittest.TestCase):
+    """Test the lean notebook runner."""
+
+    def setUp(self) -> None:
+        """Make a directory for the notebooks."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.notebook = Path(directory.name, "solution.ipynb")
+
+    def write_notebook(self, *cells: str) -> None:
+        """Write a notebook with some code cells, and a markdown cell, to run."""
+        self.notebook.write_text(
+            json.dumps(
+                {
+                    "cells": [{"cell_type": "markdown", "metadata": {}, "source": ["# Day 99"]}]
+                    + [
+                        {"cell_type": "code", "execution_count": 0, "metadata": {}, "outputs": [], "source": [x]}
+                        for x in cells
+                    ],
+                    "metadata": {},
+                    "nbformat": 4,
+                    "nbformat_minor": 2,
+                }
+            )
+        )
+
+    @patch("builtins.print", autospec=True)
+    def test_main(self, mock_print: MagicMock) -> None:
+        """We should only run the notebook if given a part, with the part as the last argument."""
+        self.write_notebook("import sys", "print(__name__, sys.argv[-1])")
+        notebook.main([str(self.notebook)])
+        mock_print.assert_not_called()
+        notebook.main([str(self.notebook), "one"])
+        mock_print.assert_called_once_with("__main__", "one")
+
+    def test_compile_notebook(self) -> None:
+        """We should only parse a notebook once, unless it changes."""
+        self.write_notebook("answer = 1")
+        code = notebook.compile_notebook(self.notebook)
+        self.assertListEqual([notebook.cached_code(self.notebook)], list(self.notebook.parent.glob("__pycache__/*")))
+
+        with patch("nbformat.read", autospec=True, side_effect=AssertionError("Parsed again")):
+            self.assertEqual(code, notebook.compile_notebook(self.notebook))
+
+        self.write_notebook("answer = 2")
+        self.assertNotEqual(code, notebook.compile_notebook(self.notebook))
+
+    @patch("builtins.print", autospec=True)
+    def test_magics(self, mock_print: MagicMock) -> None:
+        """Notebooks that use IPython's syntax should get an IPython shell."""
+        self.write_notebook("answer = !echo hello", "print(answer[0])")
+        # IPython replaces __main__, which spawned processes in later tests would otherwise try to import.
+        with patch.dict(sys.modules):
+            notebook.main([str(self.notebook), "one"])
+        mock_print.assert_called_once_with("hello")
 
 
 if __name__ == "__main__":